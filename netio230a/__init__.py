@@ -26,6 +26,17 @@
 # what to import when importing * from this package:
 __all__ = ["netio230a",]
 
-from .netio230a import netio230a, discover_netio230a_devices, get_all_detected_devices
+from .netio230a import netio230a, discover_netio230a_devices, iter_netio230a_devices, sweep_netio230a_devices, get_all_detected_devices, DiscoveredDevice
+from .state import OutletState, DeviceSnapshot
+from .asyncclient import AsyncNetio230a
+from .fleet import Fleet
+from . import pool
+from . import parser
+from . import inventory
 from .fakeserver import start_fakeserver, FakeNetio230aServer, FakeNetio230aServerHandler
+from .simulator import FakeNetio230aSimulator
+from . import capture
+from . import reconciler
 
+from . import switching
+from . import poller
@@ -0,0 +1,276 @@
+#
+# -*- encoding: UTF8 -*-
+
+
+#   This file is part of netio230a.
+#
+#   netio230a is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   netio230a is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with netio230a.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+An asyncio client for the Koukaam NETIO-230A offering the same commands as the netio230a class.
+"""
+
+import asyncio
+
+from .protocol import KshellProtocol, describeConnectionError, OUTLET_STATE_REQUESTS
+from .state import DeviceSnapshot
+from .netio230a import TELNET_SOCKET_TIMEOUT, MAX_SECONDS_WAIT_FOR_RECEIVE, MAX_SECONDS_WAIT_FOR_RECEIVE_HELLO
+
+READ_CHUNK_SIZE = 1024
+
+
+class AsyncNetio230a(object):
+    """AsyncNetio230a is the asyncio counterpart of the netio230a class. It needs no threads:
+    thousands of instances can share one event loop. Every command is a coroutine:
+
+        netio = AsyncNetio230a("192.168.1.2", "admin", "admin", True, 1234)
+        await netio.connect()
+        power = await netio.getPowerSocketList()
+        await netio.disconnect()
+
+    or use it as an asynchronous context manager (async with AsyncNetio230a(...) as netio: ...).
+    A connection closed by the device (e.g. after its 130 CONNECTION TIMEOUT) is reopened with the next command."""
+
+    def __init__(self, host, username, password, secureLogin=False, customTCPPort=23):
+        self.__host = host
+        self.__username = username
+        self.__password = password
+        self.__secureLogin = secureLogin
+        self.__tcp_port = customTCPPort
+        self.__reader = None
+        self.__writer = None
+        self.__protocol = KshellProtocol(username, password, secureLogin)
+        self.__lock = None
+        self.number_of_sent_requests = 0
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.disconnect()
+
+    def connected(self):
+        return self.__writer is not None and not self.__writer.is_closing()
+
+    async def connect(self):
+        """Opens the connection to the NETIO-230A and logs in (does nothing if already connected)."""
+        async with self.__getLock():
+            if not self.connected():
+                await self.__login()
+
+    def __getLock(self):
+        # created lazily so that the object can be constructed outside of the event loop:
+        if self.__lock is None:
+            self.__lock = asyncio.Lock()
+        return self.__lock
+
+    async def __login(self):
+        try:
+            self.__reader, self.__writer = await asyncio.wait_for(asyncio.open_connection(self.__host, self.__tcp_port), TELNET_SOCKET_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise NameError("Timeout while connecting to " + self.__host)
+        except Exception as error:
+            problem = describeConnectionError(error, self.__host)
+            if problem is None:
+                raise
+            raise NameError(problem)
+        self.__protocol.reset()
+        try:
+            loginString = self.__protocol.loginRequest(await self.__receive(MAX_SECONDS_WAIT_FOR_RECEIVE_HELLO))
+            self.__writer.write(self.__protocol.encodeRequests([loginString]))
+            self.__protocol.checkLogin(await self.__receive())
+        except NameError:
+            self.__close()
+            raise
+        except Exception as error:
+            self.__close()
+            raise NameError("Error while connecting: Login failed; " + str(error))
+
+    async def disconnect(self):
+        if not self.connected(): return
+        try:
+            # send the quit command to the box:
+            self.__writer.write(self.__protocol.encodeRequests(["quit"]))
+            await self.__receive()  # should give  110 BYE
+        except NameError:
+            pass
+        finally:
+            self.__close()
+            await self.__wait_closed()
+
+    def __close(self):
+        if self.__writer is not None:
+            self.__writer.close()
+
+    async def __wait_closed(self):
+        try:
+            await self.__writer.wait_closed()
+        except Exception:
+            pass
+
+    async def __receive(self, wait_time=MAX_SECONDS_WAIT_FOR_RECEIVE):
+        """returns the next line (bytes, without line ending) sent by the NETIO230A"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait_time
+        line = self.__protocol.nextLine()
+        while line is None:
+            remaining = deadline - loop.time()
+            try:
+                if remaining <= 0: raise asyncio.TimeoutError
+                data = await asyncio.wait_for(self.__reader.read(READ_CHUNK_SIZE), remaining)
+            except asyncio.TimeoutError:
+                raise NameError("The NETIO230A did not answer in time (%.3f s)." % wait_time)
+            if len(data) == 0:
+                self.__close()
+                raise NameError("The NETIO230A is closing the connection unexpectedly")
+            self.__protocol.receiveData(data)
+            line = self.__protocol.nextLine()
+        return line
+
+    async def pipeline(self, requests, complainIfAnswerNot250=True):
+        """Sends several requests at once and returns the list of their responses in the same order."""
+        return [response.decode("ascii") for response in await self.__sendRequests(list(requests), complainIfAnswerNot250)]
+
+    async def __sendRequest(self, request, complainIfAnswerNot250=True):
+        return (await self.__sendRawRequest(request, complainIfAnswerNot250)).decode("ascii")
+
+    async def __sendRawRequest(self, request, complainIfAnswerNot250=True):
+        return (await self.__sendRequests([request], complainIfAnswerNot250))[0]
+
+    async def __sendRequests(self, requests, complainIfAnswerNot250=True, retry=True):
+        """ returns the responses as bytes (as expected by the parsers of the protocol) """
+        if len(requests) == 0:
+            return []
+        async with self.__getLock():
+            if not self.connected():
+                await self.__login()
+            self.__writer.write(self.__protocol.encodeRequests(requests))
+            lines = []
+            try:
+                for request in requests:
+                    line = await self.__receive()
+                    if self.__protocol.isConnectionTimeout(line):
+                        # the device closed the idle connection before it got our requests
+                        self.__close()
+                        break
+                    lines.append(line)
+            except (NameError, asyncio.CancelledError):
+                # we cannot know which response belongs to which request any more:
+                self.__close()
+                raise
+        if len(lines) < len(requests):
+            if not retry:
+                raise NameError("The NETIO230A closed the connection due to a timeout.")
+            return await self.__sendRequests(requests, complainIfAnswerNot250, False)
+        self.number_of_sent_requests += len(requests)
+        # we check the responses only after having received all of them to stay in sync with the device:
+        return [self.__protocol.parseResponse(request, line, complainIfAnswerNot250) for request, line in zip(requests, lines)]
+
+    async def getPowerSocketList(self):
+        """returns a list of four boolean values specifying which power sockets are switched on"""
+        return self.__protocol.parsePowerSocketList(await self.__sendRawRequest("port list"))
+
+    async def getPowerSocketSetup(self, power_socket):
+        """returns the "port setup" string of the (zero based) power_socket as specifyed by Koukaam"""
+        return await self.__sendRequest("port setup " + str(power_socket+1))
+
+    async def setPowerSocketPower(self, power_socket, switchOn=False):
+        await self.__sendRequest(self.__protocol.powerSocketPowerRequest(power_socket, switchOn))
+
+    async def togglePowerSocketPower(self, power_socket):
+        """toggles the power status of the (one based) power_socket and returns the new status"""
+        previous_state = (await self.getPowerSocketList())[power_socket-1]
+        await self.setPowerSocketPower(power_socket, not previous_state)
+        return not previous_state
+
+    async def setPowerSocketTempInterrupt(self, power_socket):
+        await self.__sendRequest("port " + str(int(power_socket)) + " int")
+
+    async def setPowerSocketManualMode(self, power_socket, manualMode=True):
+        await self.__sendRequest("port " + str(int(power_socket)) + " manual")
+
+    async def getFirmwareVersion(self):
+        return await self.__sendRequest("version")
+
+    async def getDeviceAlias(self):
+        return await self.__sendRequest("alias")
+
+    async def setDeviceAlias(self, alias="netio230a"):
+        await self.__sendRequest("alias " + alias)
+
+    async def reboot(self):
+        response = await self.__sendRequest("reboot", False)
+        if response.startswith("120 Rebooting"):
+            await asyncio.sleep(.05) # no reboot if disconnecting too soon
+
+    async def getWatchdogSettings(self, power_socket):
+        return await self.__sendRequest("port wd " + str(power_socket))
+
+    async def getNetworkSettings(self):
+        return await self.__sendRequest("system eth")
+
+    async def setNetworkSettings(self, dhcpMode=False, deviceIP="192.168.1.2", subnetMask="255.255.255.0", gatewayIP="192.168.1.1"):
+        await self.__sendRequest(self.__protocol.networkSettingsRequest(dhcpMode, deviceIP, subnetMask, gatewayIP))
+
+    async def getDnsServer(self):
+        return await self.__sendRequest("system dns")
+
+    async def setDnsServer(self, dnsServer="192.168.1.1"):
+        await self.__sendRequest("system dns " + dnsServer)
+
+    async def getSystemDiscoverableUsingTool(self):
+        return self.__protocol.parseDiscoverable(await self.__sendRawRequest("system discover"))
+
+    async def setSystemDiscoverableUsingTool(self, setDiscoverable=True):
+        await self.__sendRequest("system discover " + ("enable" if setDiscoverable else "disable"))
+
+    async def setSwitchDelay(self, seconds):
+        return await self.__sendRequest(self.__protocol.switchDelayRequest(seconds))
+
+    async def getSwitchDelay(self):
+        return self.__protocol.parseSwitchDelay(await self.__sendRawRequest("system swdelay"))
+
+    async def getSntpSettings(self):
+        return await self.__sendRequest("system sntp")
+
+    async def setSntpSettings(self, enable=True, sntpServer="time.nist.gov"):
+        await self.__sendRequest(self.__protocol.sntpSettingsRequest(enable, sntpServer))
+
+    async def setSystemTime(self, dt):
+        await self.__sendRequest(self.__protocol.systemTimeRequest(dt))
+
+    async def getSystemTime(self):
+        """returns a datetime object"""
+        return self.__protocol.parseSystemTime(await self.__sendRawRequest("system time"))
+
+    async def getSystemUptime(self):
+        """returns a timedelta object"""
+        return self.__protocol.parseSystemUptime(await self.__sendRawRequest("uptime"))
+
+    async def getSystemTimezone(self):
+        """returns the timezone offset from UTC in hours of the NETIO-230A"""
+        return self.__protocol.parseSystemTimezone(await self.__sendRawRequest("system timezone"))
+
+    async def setSystemTimezone(self, hoursOffset):
+        await self.__sendRequest(self.__protocol.systemTimezoneRequest(hoursOffset))
+
+    async def getAllPowerSockets(self):
+        """returns a tuple of four (immutable) OutletState objects"""
+        return (await self.getDeviceSnapshot()).outlets
+
+    async def getDeviceSnapshot(self):
+        """returns a DeviceSnapshot with the state of all four power sockets (fetched with a single round trip)"""
+        return DeviceSnapshot.create(self.__host, self.__protocol.parseOutletStates(await self.__sendRequests(OUTLET_STATE_REQUESTS)))
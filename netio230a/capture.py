@@ -0,0 +1,235 @@
+#
+# -*- encoding: UTF8 -*-
+
+
+#   This file is part of netio230a.
+#
+#   netio230a is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   netio230a is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with netio230a.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Record and replay KSHELL traffic.
+
+A capture is a JSON lines file: a header followed by one frame per line sent or
+received (with a timestamp, the direction and for responses the latency since
+their request). The client and the fake server can write captures:
+
+    capture = netio230a.capture.CaptureWriter("incident.jsonl")
+    netio = netio230a.netio230a(host, "admin", "admin", True, capture=capture)
+
+A fake device can replay a capture (the same answers with the same latencies),
+which turns a recorded incident into a deterministic test:
+
+    device = FakeNetio230a(replay=netio230a.capture.Replay.load("incident.jsonl"))
+"""
+
+import json
+import threading
+import time
+from datetime import datetime
+from collections import namedtuple, deque
+
+from .fakeserver import encodeLines, N_UNKNOWN
+
+CAPTURE_VERSION = 1
+# the directions of the frames:
+REQUEST = "request"
+RESPONSE = "response"
+CLOSE = "close"
+
+# time and latency are given in seconds (time since the start of the capture),
+# latency is None for what the device sends without being asked (like the welcome message)
+Frame = namedtuple('Frame', ['time', 'session', 'direction', 'data', 'latency'])
+
+
+def maskRequest(line):
+    """ hides the password of a cleartext login (a clogin only contains a salted hash) """
+    if line.startswith("login "):
+        fragments = line.split(" ")
+        if len(fragments) > 2:
+            return " ".join(fragments[:2] + ["*"])
+    return line
+
+
+class CaptureWriter(object):
+    """ Writes the frames of one or more sessions (connections) to a capture file.
+    output is a file name or an open text file; the writer can be shared by threads. """
+
+    def __init__(self, output, source="client", peer=None):
+        self.__lock = threading.Lock()
+        self.__own_file = isinstance(output, str)
+        self.__file = open(output, 'w') if self.__own_file else output
+        self.__start = time.monotonic()
+        self.__sessions = 0
+        # the times the requests still waiting for a response were sent (per session):
+        self.__pending = {}
+        self.__write({'capture': "netio230a", 'version': CAPTURE_VERSION, 'source': source,
+                      'peer': peer, 'started': datetime.now().isoformat()})
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def newSession(self):
+        """ returns the number of a new session (call it for every connection) """
+        with self.__lock:
+            self.__sessions += 1
+            self.__pending[self.__sessions] = deque()
+            return self.__sessions
+
+    def request(self, session, line):
+        with self.__lock:
+            now = time.monotonic()
+            self.__pending[session].append(now)
+            self.__frame(now, session, REQUEST, maskRequest(line))
+
+    def response(self, session, line):
+        with self.__lock:
+            now = time.monotonic()
+            pending = self.__pending[session]
+            latency = now - pending.popleft() if pending else None
+            self.__frame(now, session, RESPONSE, line, latency)
+
+    def closed(self, session):
+        with self.__lock:
+            if self.__pending.pop(session, None) is not None:
+                self.__frame(time.monotonic(), session, CLOSE)
+
+    def close(self):
+        with self.__lock:
+            if self.__own_file:
+                self.__file.close()
+            else:
+                self.__file.flush()
+
+    def __frame(self, now, session, direction, data=None, latency=None):
+        frame = {'t': round(now - self.__start, 6), 'session': session, 'dir': direction}
+        if data is not None:
+            frame['data'] = data
+        if latency is not None:
+            frame['latency'] = round(latency, 6)
+        self.__write(frame)
+
+    def __write(self, record):
+        self.__file.write(json.dumps(record, separators=(',', ':')) + "\n")
+        # flushed right away: a capture is most useful when things go wrong
+        self.__file.flush()
+
+
+def readCapture(path):
+    """ returns (header, frames) of a capture file """
+    with open(path, 'r') as infile:
+        header = json.loads(infile.readline())
+        if header.get('capture') != "netio230a":
+            raise NameError("%s is not a netio230a capture." % path)
+        frames = []
+        for line in infile:
+            if line.strip() == "":
+                continue
+            record = json.loads(line)
+            frames.append(Frame(record['t'], record['session'], record['dir'], record.get('data'), record.get('latency')))
+    return header, frames
+
+
+class ReplayedSession(object):
+    """ One recorded connection: the welcome message and for every request the
+    responses (with the pauses between them) and whether the device closed the connection. """
+
+    def __init__(self, number, frames):
+        self.number = number
+        # the writes of the device before the first request:
+        self.welcome = []
+        # [(request, writes, close)]
+        self.steps = []
+        self.position = 0
+        # the steps still waiting for their response with the times of their requests
+        # (like in CaptureWriter.response() the responses are paired with the requests in order):
+        waiting = deque()
+        # the step the last response belongs to (None for the welcome message):
+        current = None
+        last = frames[0].time if frames else 0.
+        for frame in frames:
+            if frame.direction == REQUEST:
+                step = [frame.data, [], False]
+                self.steps.append(step)
+                waiting.append((step, frame.time))
+            elif frame.direction == RESPONSE:
+                since = last
+                if waiting:
+                    # a pipelined response can't be sent before its request nor before the previous response:
+                    current, requested = waiting.popleft()
+                    since = max(requested, last)
+                writes = self.welcome if current is None else current[1]
+                writes.append((max(0., frame.time - since), encodeLines([frame.data])))
+                last = frame.time
+            elif frame.direction == CLOSE and self.steps:
+                (current or self.steps[-1])[2] = True
+
+    def finished(self):
+        return self.position >= len(self.steps)
+
+    def expected(self):
+        """ returns the next recorded request (None if the recording has ended) """
+        return None if self.finished() else self.steps[self.position][0]
+
+    def advance(self):
+        """ returns (writes, close) for the next recorded request """
+        request, writes, close = self.steps[self.position]
+        self.position += 1
+        return writes, close
+
+
+class Replay(object):
+    """ The sessions of a capture to be replayed by a fake device (see FakeNetio230a).
+    Every connection to the device replays the next recorded session, the device refuses
+    connections once all of them are used. The requests which differ from the recorded
+    ones are collected in mismatches as (session, expected request, received request) and
+    answered with 502 UNKNOWN COMMAND (the recording waits for the expected request). """
+
+    def __init__(self, frames):
+        sessions = {}
+        for frame in frames:
+            sessions.setdefault(frame.session, []).append(frame)
+        self.sessions = [ReplayedSession(number, sessions[number]) for number in sorted(sessions)]
+        self.mismatches = []
+        self.__next = 0
+        self.__lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        header, frames = readCapture(path)
+        return cls(frames)
+
+    def nextSession(self):
+        """ returns the ReplayedSession for a new connection (or None if all of them are used) """
+        with self.__lock:
+            if self.__next >= len(self.sessions):
+                return None
+            self.__next += 1
+            return self.sessions[self.__next-1]
+
+    def answer(self, session, request):
+        """ returns (writes, close) for a request of the client """
+        expected = session.expected()
+        if expected != maskRequest(request):
+            with self.__lock:
+                self.mismatches.append((session.number, expected, request))
+            return [(0., encodeLines([N_UNKNOWN]))], False
+        return session.advance()
+
+    def finished(self):
+        """ True if every recorded request was replayed """
+        return self.__next == len(self.sessions) and all([session.finished() for session in self.sessions])
@@ -35,7 +35,20 @@ try:
 except ImportError:
     pass
 
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows (the store is then only safe for the threads of a single process)
+    fcntl = None
+
 from datetime import datetime
+from collections import namedtuple, OrderedDict
+from contextlib import contextmanager
+import threading
+import itertools
+import ipaddress
+import csv
+import re
 import os
 import sys
 
@@ -51,43 +64,290 @@ try:
 except:
     BACKEND = pickle
     CONFIGURATION_FILE = os.path.expanduser("~/.netio230a/connections.pickle")
+# pickle needs files opened in binary mode:
+BINARY = "b" if BACKEND is pickle else ""
 
-def changeConfiguration(action, devicename, host, port, username, password):
+# a stored connection (last_used is given in ISO format), stored as a list in the configuration file:
+Connection = namedtuple('Connection', ['devicename', 'host', 'port', 'username', 'password', 'last_used'])
+
+# the formats for importing and exporting connections (see importConnections()):
+CSV = "csv"
+JSON_LINES = "jsonl"
+HOSTNAME_LABEL_PATTERN = re.compile(r"[A-Za-z0-9]([A-Za-z0-9-]{0,61}[A-Za-z0-9])?")
+# report at most so many invalid rows of an import:
+MAX_REPORTED_ERRORS = 10
+
+
+def validHost(host):
+    """ True for an IP address or a valid hostname """
     try:
-        os.makedirs(os.path.split(CONFIGURATION_FILE)[0])
-    except StandardError as error:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
         pass
-        
+    labels = host[:-1].split(".") if host.endswith(".") else host.split(".")
+    if len(host) > 253 or all([label.isdigit() for label in labels]):
+        # like 10.0.0.256
+        return False
+    return all([HOSTNAME_LABEL_PATTERN.fullmatch(label) is not None for label in labels])
+
+def connectionFromRow(row, last_used=None):
+    """ returns the Connection for a dict with the keys devicename, host, port, username, password
+    (and optionally last_used), raises NameError if it is invalid """
+    try:
+        devicename, host, port, username, password = [row[key] for key in Connection._fields[0:5]]
+    except KeyError as error:
+        raise NameError("missing field %s" % error)
+    except TypeError:
+        raise NameError("not a record")
+    if not devicename or not username:
+        raise NameError("missing devicename or username")
+    if not isinstance(host, str) or not validHost(host):
+        raise NameError("invalid host %r" % (host,))
+    try:
+        port = int(port)
+    except (TypeError, ValueError):
+        raise NameError("invalid port %r" % (port,))
+    if not 0 < port < 65536:
+        raise NameError("invalid port %d" % port)
+    return Connection(devicename, host, port, username, password, row.get('last_used') or last_used or datetime.now().isoformat())
+
+def readConnections(lines, format=None):
+    """ yields (line number, row dict) for the lines (a text file or any iterable of lines) in
+    CSV (with a header line) or JSON lines format (guessed from the first line if format is None) """
+    lines = iter(lines)
+    first = next(lines, None)
+    if first is None:
+        return
+    if format is None:
+        format = JSON_LINES if first.lstrip().startswith("{") else CSV
+    if format == CSV:
+        reader = csv.DictReader(itertools.chain([first], lines))
+        for row in reader:
+            yield reader.line_num, row
+    elif format == JSON_LINES:
+        for number, line in enumerate(itertools.chain([first], lines), 1):
+            if line.strip() == "":
+                continue
+            try:
+                yield number, json.loads(line)
+            except ValueError:
+                yield number, None
+    else:
+        raise NameError("Unknown format of connections: %s" % format)
+
+
+def fileSignature(path):
+    """ returns what changes whenever the file is written (None if it doesn't exist)
+    The modification time alone isn't enough: two writes within one tick of a coarse clock leave the
+    same time, but every atomic replace creates a new inode. """
     try:
-        # try to get stored configuration (if it exists)
-        configuration = getConfiguration()
-    except StandardError as error:
-        # or create an empty list for the new configuration
-        configuration = []
+        status = os.stat(path)
+    except OSError:
+        return None
+    return (status.st_ino, status.st_mtime_ns, status.st_size)
+
+
+# what reading a damaged file may raise:
+UNREADABLE_FILE_ERRORS = (IOError, ValueError, KeyError, TypeError, EOFError, pickle.UnpicklingError)
+
+
+class SharedFile(object):
+    """ A file shared by the threads and processes of a user (like the stored connections or the inventory).
+
+    The content is read with load(infile) when it is first needed and again when another process
+    has changed the file (a missing or unreadable file gives empty()). Changes are made holding a
+    lock file and written atomically with dump(content, outfile) to a temporary file which then
+    replaces the file, so several processes can change it at the same time without losing anything:
+
+        with shared.locked() as content:
+            content[key] = value
+            shared.save()
+    """
+
+    def __init__(self, path, load, dump, empty, binary=False):
+        self.path = path
+        self.__load_content = load
+        self.__dump_content = dump
+        self.__empty = empty
+        self.__mode = "b" if binary else ""
+        self.__lock = threading.Lock()
+        self.__content = None
+        self.__loaded_signature = None
+
+    @contextmanager
+    def loaded(self):
+        """ holds the lock of the threads and the current content for reading it """
+        with self.__lock:
+            self.__load()
+            yield self.__content
+
+    @contextmanager
+    def locked(self):
+        """ holds the locks (of the threads and processes) and the current content for a change """
+        with self.__lock:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.isdir(directory):
+                os.makedirs(directory)
+            if fcntl is None:
+                self.__load(force=True)
+                yield self.__content
+                return
+            with open(self.path + ".lock", 'w') as lockfile:
+                fcntl.flock(lockfile, fcntl.LOCK_EX)
+                try:
+                    # another process might have changed the file while we were waiting
+                    # (a change is read anyway, whatever the file system tells about it):
+                    self.__load(force=True)
+                    yield self.__content
+                finally:
+                    fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+    def save(self):
+        """ writes the content atomically (must be called within locked()) """
+        temporary = "%s.%d.%d.tmp" % (self.path, os.getpid(), threading.get_ident())
+        try:
+            with open(temporary, 'w' + self.__mode) as outfile:
+                self.__dump_content(self.__content, outfile)
+            os.replace(temporary, self.path)
+        except BaseException:
+            # the change wasn't stored (it is forgotten with the next read),
+            # and the half written file isn't left behind:
+            self.__content = None
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+        self.__loaded_signature = fileSignature(self.path)
+
+    def __load(self, force=False):
+        """ (re)reads the file if it changed (must be called holding the lock) """
+        signature = fileSignature(self.path)
+        if self.__content is not None and signature == self.__loaded_signature and not force:
+            return
+        content = self.__empty()
+        if signature is not None:
+            try:
+                with open(self.path, 'r' + self.__mode) as infile:
+                    content = self.__load_content(infile)
+            except UNREADABLE_FILE_ERRORS:
+                # an unreadable file is replaced by the next change
+                content = self.__empty()
+        self.__content = content
+        self.__loaded_signature = signature
+
+
+def _loadConnections(infile):
+    """ returns {key: Connection}, the least recently used first """
+    entries = OrderedDict()
+    # the file lists the most recently used connection first:
+    for row in reversed(retrieve(infile)):
+        connection = Connection(*row)
+        entries[connection[0:4]] = connection
+    return entries
+
+def _dumpConnections(entries, outfile):
+    store([list(connection) for connection in reversed(entries.values())], outfile)
+
+
+class ConnectionStore(object):
+    """ The connections (credentials) used before, keyed by (devicename, host, port, username).
+
+    The file is only read when the connections are first needed (and again when another
+    process has changed it). Changes are written atomically while holding a lock file
+    (see SharedFile), so several processes can save their connections at the same time
+    without losing any. """
+
+    def __init__(self, path=CONFIGURATION_FILE):
+        self.path = path
+        self.__file = SharedFile(path, _loadConnections, _dumpConnections, OrderedDict, binary=BINARY == "b")
+
+    def __len__(self):
+        with self.__file.loaded() as entries:
+            return len(entries)
+
+    def connections(self):
+        """ returns the list of all stored connections, the most recently used first """
+        with self.__file.loaded() as entries:
+            return list(reversed(entries.values()))
+
+    def get(self, devicename, host, port, username):
+        """ returns the stored Connection (or None) """
+        with self.__file.loaded() as entries:
+            return entries.get((devicename, host, port, username))
+
+    def update(self, devicename, host, port, username, password):
+        """ stores the connection (as the most recently used one) """
+        connection = Connection(devicename, host, port, username, password, datetime.now().isoformat())
+        with self.__file.locked() as entries:
+            entries.pop(connection[0:4], None)
+            entries[connection[0:4]] = connection
+            self.__file.save()
+        return connection
+
+    def importConnections(self, lines, format=None):
+        """ stores all connections of a CSV or JSON lines file (see readConnections()) with a single write.
+        The rows are parsed one by one; if any of them is invalid, nothing is stored and NameError is raised.
+        The order of the rows is kept (the first row is considered the most recently used connection).
+        returns the number of imported connections """
+        now = datetime.now().isoformat()
+        imported = OrderedDict()
+        errors = []
+        for number, row in readConnections(lines, format):
+            try:
+                connection = connectionFromRow(row, now)
+            except NameError as error:
+                errors.append("line %d: %s" % (number, error))
+                continue
+            imported.pop(connection[0:4], None)
+            imported[connection[0:4]] = connection
+        if errors:
+            raise NameError("Invalid connections (%d), nothing was imported:\n%s" % (len(errors), "\n".join(errors[:MAX_REPORTED_ERRORS])))
+        if imported:
+            with self.__file.locked() as entries:
+                # the first row becomes the most recently used connection (as in exports):
+                for key, connection in reversed(imported.items()):
+                    entries.pop(key, None)
+                    entries[key] = connection
+                self.__file.save()
+        return len(imported)
+
+    def exportConnections(self, outfile, format=CSV):
+        """ writes all connections (the most recently used first) as CSV or JSON lines to a text file """
+        connections = self.connections()
+        if format == CSV:
+            writer = csv.writer(outfile)
+            writer.writerow(Connection._fields)
+            writer.writerows(connections)
+        elif format == JSON_LINES:
+            for connection in connections:
+                outfile.write(json.dumps(connection._asdict()) + "\n")
+        else:
+            raise NameError("Unknown format of connections: %s" % format)
+        return len(connections)
+
+    def remove(self, devicename, host, port, username):
+        """ returns True if the connection was stored """
+        with self.__file.locked() as entries:
+            if entries.pop((devicename, host, port, username), None) is None:
+                return False
+            self.__file.save()
+        return True
+
+
+# the store shared by the whole process:
+default_store = ConnectionStore()
+
+def changeConfiguration(action, devicename, host, port, username, password):
+    """ stores (action UPDATE) or removes (action REMOVE) a connection, returns False on errors """
     try:
-        old_device, new_device = None, None
-        for device in configuration:
-            if device[0] == devicename and device[1] == host and device[2] == port and device[3] == username:
-                old_device = device
-                new_device = [devicename, host, port, username, password, datetime.now().isoformat()]
-        
         if action == UPDATE:
-            if new_device == None and old_device == None:
-                configuration.append([devicename, host, port, username, password, datetime.now().isoformat()])
-            else:
-                configuration.remove(old_device)
-                configuration.append(new_device)
+            default_store.update(devicename, host, port, username, password)
         elif action == REMOVE:
-            if old_device != None:
-                configuration.remove(old_device)
-        
-        configuration.sort(key=sort_configuration)
-        configuration.reverse()
-        outfile = open(CONFIGURATION_FILE,'w')
-        store(configuration,outfile)
-        outfile.close()
+            default_store.remove(devicename, host, port, username)
         return True
-    except StandardError as error:
+    except (IOError, OSError, ValueError) as error:
         print(str(error))
         return False
 
@@ -101,16 +361,35 @@ def sort_configuration(config_row):
     return config_row[5]
 
 def getConfiguration():
+    """ returns the stored connections as lists [devicename, host, port, username, password, last_used],
+    the most recently used first """
     try:
-        infile = open(CONFIGURATION_FILE,'r')
-        configuration = retrieve(infile)
-        infile.close()
-        return configuration
-    except StandardError as error:
+        return [list(connection) for connection in default_store.connections()]
+    except (IOError, OSError) as error:
         return []
 
+def importConnections(lines, format=None):
+    """ stores the connections of a CSV or JSON lines file in a single write (see ConnectionStore.importConnections()) """
+    return default_store.importConnections(lines, format)
+
+def exportConnections(outfile, format=CSV):
+    return default_store.exportConnections(outfile, format)
+
+def resolveHost(host):
+    """ returns the IP address of the device if host is the name (or MAC address) of a device
+    in the inventory of discovered devices and host itself otherwise """
+    from .inventory import resolve
+    return resolve(host)
+
 if __name__ == "__main__":
-    print("You have %d connections stored in your configuration file." % len(getConfiguration()) )
+    # python -m netio230a.configuration [import FILE | export [FORMAT]]
+    if len(sys.argv) > 2 and sys.argv[1] == "import":
+        with open(sys.argv[2], 'r', newline='') as infile:
+            print("Imported %d connections." % importConnections(infile))
+    elif len(sys.argv) > 1 and sys.argv[1] == "export":
+        exportConnections(sys.stdout, sys.argv[2] if len(sys.argv) > 2 else CSV)
+    else:
+        print("You have %d connections stored in your configuration file." % len(getConfiguration()) )
 
 
 
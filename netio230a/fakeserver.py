@@ -31,14 +31,19 @@ import string
 import hashlib
 import re
 import datetime
+import copy
+import time
+import socket
+import struct
 import sys
+import bisect
 
+from .protocol import LineBuffer
+from . import parser
 
-# we need to initialize the variable here, because we need the global scope:
-fake_server = None
 
 # Koukaam Netio230A Behaviour:
-N_WELCOME = "100 HELLO %X - KSHELL V1.2" # welcome message
+N_WELCOME = "100 HELLO %08X - KSHELL V1.2" # welcome message
 N_OK = "250 " # OK prefix
 N_OK_L = "250 OK" # complete OK line
 N_VER = "250 V %s"
@@ -52,263 +57,737 @@ N_AUTH_ERR = "503 INVALID LOGIN"
 N_ALR_AUTH = "504 ALREADY LOGGED IN"
 N_FORB = "505 FORBIDDEN"
 N_BYE = "110 BYE"
+N_REBOOT = "120 Rebooting..." # the device closes the connection and restarts (without switching the outlets)
+N_TIMEOUT = "130 CONNECTION TIMEOUT" # sent before the device closes an idle connection
 N_LINE_ENDING = "\r\n"
 
 N_ALIAS_LENGTH = 18
 N_NUM_OUTLETS = 4
 N_MAX_SWDELAY = 999
+N_MAX_TIMEZONE = 14*3600 # [in seconds]
+N_TIME_FORMAT = "%Y/%m/%d,%H:%M:%S"
+N_UPTIME = "%d years %d days %d hours %d min %d sec"
+N_IPV4_PATTERN = re.compile(r"(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})")
 
 # Fake Netio230A configuration:
 ADMIN_USERNAME="admin"
 ADMIN_PASSWORD="admin"
 
-class InvVError(Exception):
-    pass
-class InvPError(Exception):
-    pass
+READ_CHUNK_SIZE = 1024
+# the number of sessions of all devices is changed by the threads of the FakeNetio230aServer:
+sessions_lock = threading.Lock()
+
+def encodeLines(lines):
+    return "".join([line + N_LINE_ENDING for line in lines]).encode('ascii')
+
+def validAddress(address):
+    match = N_IPV4_PATTERN.fullmatch(address)
+    return match is not None and all([int(byte) <= 255 for byte in match.groups()])
+
+# the connection gets closed after sending these:
+CLOSING_RESPONSES = frozenset([N_BYE, N_REBOOT])
+
+def enableDisable(flag):
+    return "enable" if flag else "disable"
+
+class FakeKshellSession(object):
+    """ The KSHELL session of a client with a fake device without any I/O.
+
+    It is used by the threaded FakeNetio230aServerHandler as well as by the asyncio
+    FakeNetio230aSimulator: they pass the data they receive to receiveData() and
+    write what it returns (with the pauses the profile of the device asks for),
+    passing what they have written to sent(). """
+
+    def startSession(self, device, log, capture=None):
+        """ returns False if the device refuses the session (see FakeNetio230aProfile.single_session)
+        capture is an optional capture.CaptureWriter to record the session with """
+        self.device = device
+        self.profile = device.profile
+        self.log = log
+        self.capture = None
+        self.replayed = None
+        if device.replay is not None:
+            self.replayed = device.replay.nextSession()
+            if self.replayed is None:
+                # there is nothing more to replay
+                return False
+        # clients like telnet or netcat terminate their lines with a "\n" only
+        # (the "\r" is removed when the command gets processed):
+        self.lines = LineBuffer(line_ending=b"\n")
+        # the salt for the md5 password hash:
+        self.salt = random.randint(0, 2**32-1)
+        self.authenticated = False
+        self.active = False
+        with sessions_lock:
+            if self.profile.single_session and device.sessions > 0:
+                return False
+            device.sessions += 1
+        self.active = True
+        if capture is not None:
+            self.capture = capture
+            self.capture_session = capture.newSession()
+            # the lines written to the client:
+            self.sent_lines = LineBuffer()
+        return True
+
+    def endSession(self):
+        with sessions_lock:
+            if self.active:
+                self.device.sessions -= 1
+                self.active = False
+                if self.capture is not None:
+                    self.capture.closed(self.capture_session)
+
+    def welcome(self):
+        """ returns the writes for the welcome message """
+        if self.replayed is not None:
+            return self.replayed.welcome
+        return [(0, encodeLines([N_WELCOME % self.salt]))]
+
+    def sent(self, data):
+        """ to be called with the data written to the client (for the capture) """
+        if self.capture is None:
+            return
+        self.sent_lines.feed(data)
+        line = self.sent_lines.readline()
+        while line is not None:
+            self.capture.response(self.capture_session, line.decode('ascii'))
+            line = self.sent_lines.readline()
+
+    def idleTimeout(self):
+        """ returns the writes for a connection being closed because the client was idle for too long """
+        return [(0, encodeLines([N_TIMEOUT]))]
+
+    def receiveData(self, data, answer=None):
+        """ processes all complete lines of the data received so far and returns (writes, close):
+        writes is a list of (pause, bytes) (wait pause seconds before writing the bytes) and
+        close tells whether the connection is to be closed after the writes.
+        answer(request) is called with every line (str) and returns (writes, close) for it,
+        by default the lines are answered by the replayed session or else by respond() """
+        if answer is None and self.replayed is not None:
+            answer = self.__replay
+        writes = []
+        answers = []
+        close = False
+        self.lines.feed(data)
+        line = self.lines.readline()
+        while line is not None and not close:
+            request = line.rstrip(b"\r").decode('ascii', errors='replace')
+            if self.capture is not None:
+                self.capture.request(self.capture_session, request)
+            if answer is None:
+                responses, close = self.respond(line)
+                if responses:
+                    answers.append(responses)
+            else:
+                answered, close = answer(request)
+                writes += answered
+            line = self.lines.readline()
+        return writes + self.profile.schedule(answers), close
+
+    def __replay(self, request):
+        self.log(request+"\n")
+        return self.device.replay.answer(self.replayed, request)
+
+    def respond(self, data):
+        """ returns (responses, close): the list of lines to send for the line data (bytes)
+        received from the client and whether the connection should be closed afterwards """
+        profile = self.profile
+        faulty = profile.faulty
+        if self.device.telnet_crashed or (faulty and profile.roll('crash_probability')):
+            # the telnet server of the hardware sometimes ends up in this state until a reboot
+            self.device.telnet_crashed = True
+            return [N_UNKNOWN], False
+        if faulty and profile.roll('timeout_probability'):
+            return [N_TIMEOUT], True
+        # the device answers anything but ASCII as an unknown command:
+        line = data.decode('ascii', errors='replace')
+        self.log(line+"\n")
+        if '\ufffd' in line:
+            return [N_UNKNOWN], False
+        command, separator, arguments = line.strip().partition(' ')
+        if self.authenticated:
+            handler = self.COMMANDS.get(command, FakeKshellSession.__unknown)
+        else:
+            # we wait for an authentication request before serving anything else
+            handler = self.LOGIN_COMMANDS.get(command, FakeKshellSession.__forbidden)
+        responses = handler(self, arguments)
+        return responses, responses[-1] in CLOSING_RESPONSES
+
+    ### The handlers of the commands get the arguments (the rest of the line) and return the lines to send.
+
+    def __unknown(self, arguments):
+        return [N_UNKNOWN]
+
+    def __forbidden(self, arguments):
+        return [N_FORB]
+
+    def __quit(self, arguments):
+        return [N_BYE] if arguments == '' else [N_UNKNOWN]
+
+    def __login(self, arguments):
+        fragments = arguments.split(' ')
+        if len(fragments) < 2: return [N_AUTH_ERR]
+        self.authenticated = ADMIN_USERNAME == fragments[0] and ADMIN_PASSWORD == fragments[1]
+        return [N_OK_L if self.authenticated else N_AUTH_ERR]
+
+    def __clogin(self, arguments):
+        fragments = arguments.split(' ')
+        if len(fragments) < 2: return [N_AUTH_ERR]
+        md = hashlib.md5()
+        to_hash = ADMIN_USERNAME+ADMIN_PASSWORD+"%08X" % self.salt
+        md.update(to_hash.encode("ascii"))
+        self.authenticated = ADMIN_USERNAME == fragments[0] and md.hexdigest() == fragments[1]
+        return [N_OK_L if self.authenticated else N_AUTH_ERR]
+
+    def __alreadyAuthenticated(self, arguments):
+        return [N_ALR_AUTH]
+
+    def __version(self, arguments):
+        return [N_VER % self.device.version] if arguments == '' else [N_UNKNOWN]
+
+    def __alias(self, arguments):
+        if arguments == '':
+            return [N_ALIAS % self.device.alias]
+        new_alias = arguments.split(' ')[0]
+        if len(new_alias) > N_ALIAS_LENGTH: return [N_INV_P]
+        self.device.alias = new_alias
+        return [N_OK_L]
+
+    def __uptime(self, arguments):
+        if arguments != '': return [N_UNKNOWN]
+        seconds = int(self.device.getUptime().total_seconds())
+        days, seconds = divmod(seconds, 86400)
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
+        return [N_OK + N_UPTIME % (days // 365, days % 365, hours, minutes, seconds)]
+
+    def __reboot(self, arguments):
+        if arguments != '': return [N_UNKNOWN]
+        self.device.reboot()
+        return [N_REBOOT]
+
+    def __system(self, arguments):
+        setting, separator, value = arguments.partition(' ')
+        return self.SYSTEM_COMMANDS.get(setting, FakeKshellSession.__unknown)(self, value.strip())
+
+    def __systemDiscover(self, value):
+        if value == '':
+            return [N_BOOLEAN % enableDisable(self.device.discover)]
+        if value[0] not in 'ed': return [N_INV_V]
+        self.device.discover = value[0] == 'e'
+        return [N_OK_L]
+
+    def __systemSwdelay(self, value):
+        if value == '':
+            return [N_SWDELAY % self.device.swdelay]
+        try:
+            value = int(value)
+        except ValueError:
+            return [N_INV_V]
+        if not 0 <= value <= N_MAX_SWDELAY: return [N_INV_V]
+        self.device.swdelay = value
+        return [N_OK_L]
+
+    def __systemTime(self, value):
+        if value == '':
+            return [N_OK + self.device.getTime().strftime(N_TIME_FORMAT)]
+        try:
+            self.device.setTime(datetime.datetime.strptime(value, N_TIME_FORMAT))
+        except ValueError:
+            return [N_INV_V]
+        return [N_OK_L]
+
+    def __systemTimezone(self, value):
+        if value == '':
+            return [N_OK + str(self.device.timezone)]
+        try:
+            value = int(value)
+        except ValueError:
+            return [N_INV_V]
+        if abs(value) > N_MAX_TIMEZONE: return [N_INV_V]
+        self.device.timezone = value
+        return [N_OK_L]
+
+    def __systemEth(self, value):
+        device = self.device
+        if value == '':
+            return [N_OK + "%s %s %s %s" % ("dhcp" if device.dhcp_mode else "manual", device.ip, device.subnet, device.gateway)]
+        fragments = value.split()
+        if fragments == ['dhcp']:
+            device.dhcp_mode = True
+            return [N_OK_L]
+        if len(fragments) != 4 or fragments[0] != 'manual':
+            return [N_INV_P]
+        if not all([validAddress(address) for address in fragments[1:]]):
+            return [N_INV_V]
+        device.dhcp_mode = False
+        device.ip, device.subnet, device.gateway = fragments[1:]
+        return [N_OK_L]
+
+    def __systemDns(self, value):
+        if value == '':
+            return [N_OK + self.device.dns]
+        if not validAddress(value): return [N_INV_V]
+        self.device.dns = value
+        return [N_OK_L]
+
+    def __systemSntp(self, value):
+        if value == '':
+            return [N_OK + "%s %s" % (enableDisable(self.device.sntp_enabled), self.device.sntp_server)]
+        fragments = value.split()
+        if len(fragments) > 2 or fragments[0] not in ['enable', 'disable']:
+            return [N_INV_P]
+        self.device.sntp_enabled = fragments[0] == 'enable'
+        if len(fragments) == 2:
+            self.device.sntp_server = fragments[1]
+        return [N_OK_L]
+
+    def __port(self, arguments):
+        if arguments == '':
+            return [N_INV_P] # this is what you get for the invalid command `port`
+        name, separator, value = arguments.partition(' ')
+        handler = self.PORT_COMMANDS.get(name)
+        if handler is not None:
+            return handler(self, value.strip())
+        if len(name) == 1:
+            return self.__portOutlet(name, value.strip())
+        return [N_UNKNOWN]
+
+    def __outlet(self, number):
+        """ returns the outlet with the (one based) number given as a string or None if there is no such outlet """
+        try:
+            which = int(number)
+        except ValueError:
+            return None
+        if not which in range(1,N_NUM_OUTLETS+1):
+            return None
+        return self.device.outlets[which-1]
+
+    def __portList(self, value):
+        if value == '':
+            return [N_OK + ''.join([str(int(status)) for status in self.device.getOutlets()])]
+        if len(value) != N_NUM_OUTLETS or not all([state in '01iu' for state in value]):
+            return [N_INV_V]
+        self.device.setOutlets(value)
+        return [N_OK_L]
+
+    def __portSetup(self, value):
+        number, separator, value = value.partition(' ')
+        outlet = self.__outlet(number)
+        if outlet is None: return [N_INV_P]
+        if value == '':
+            return [N_OK + '"%s" %s %d %d' % (outlet.name, "timer" if outlet.timer.enabled else "manual", outlet.interrupt_delay, outlet.power_status_after_power_on)]
+        try:
+            # port setup 1 "name" manual|timer interrupt_delay power_on_after_power_loss
+            setup = parser.parsePortSetup(value.strip().encode('ascii'))
+        except NameError:
+            return [N_INV_P]
+        if len(setup.name) > N_ALIAS_LENGTH: return [N_INV_V]
+        outlet.name = setup.name
+        outlet.timer.enabled = not setup.manual_mode
+        outlet.interrupt_delay = setup.interrupt_delay
+        outlet.power_status_after_power_on = setup.power_on_after_power_loss
+        return [N_OK_L]
+
+    def __portWatchdog(self, value):
+        number, separator, value = value.partition(' ')
+        outlet = self.__outlet(number)
+        if outlet is None: return [N_INV_P]
+        watchdog = outlet.watchdog
+        if value == '':
+            return [N_OK + "%s %s %d %d %d %d %s %s" % (enableDisable(watchdog.enabled), watchdog.ip, watchdog.timeout,
+                    watchdog.power_on_delay, watchdog.ping_interval, watchdog.max_retry,
+                    enableDisable(watchdog.retry_power_off), enableDisable(watchdog.send_email))]
+        try:
+            # port wd 1 enable|disable ip timeout power_on_delay ping_interval max_retry retry_power_off send_email
+            settings = parser.parseWatchdogSettings(" ".join(value.split()).encode('ascii'))
+        except NameError:
+            return [N_INV_P]
+        if not validAddress(settings.ip): return [N_INV_V]
+        for name, setting in settings._asdict().items():
+            setattr(watchdog, name, setting)
+        return [N_OK_L]
+
+    def __portOutlet(self, number, value):
+        outlet = self.__outlet(number)
+        if outlet is None: return [N_INV_P]
+        if value == '':
+            return [N_OK + str(int(outlet.powerStatus()))]
+        if value == 'int':
+            outlet.interrupt(time.monotonic())
+            return [N_OK_L]
+        if value == 'manual':
+            outlet.timer.enabled = False
+            return [N_OK_L]
+        try:
+            to = int(value)
+        except ValueError:
+            return [N_INV_P]
+        if not (to in [0,1]):
+            return [N_INV_V]
+        outlet.switch(to)
+        return [N_OK_L]
+
+    # still unknown commands:
+    #port timer
+    #email server
 
-class FakeNetio230aServerHandler(socketserver.BaseRequestHandler):
+    # the handlers by the first word of the command:
+    COMMANDS = {
+        'quit': __quit,
+        'login': __alreadyAuthenticated,
+        'clogin': __alreadyAuthenticated,
+        'version': __version,
+        'alias': __alias,
+        'uptime': __uptime,
+        'reboot': __reboot,
+        'system': __system,
+        'port': __port,
+    }
+    LOGIN_COMMANDS = {
+        'quit': __quit,
+        'login': __login,
+        'clogin': __clogin,
+    }
+    # the handlers by the second word (the rest of the line is passed as the value):
+    SYSTEM_COMMANDS = {
+        'discover': __systemDiscover,
+        'swdelay': __systemSwdelay,
+        'time': __systemTime,
+        'timezone': __systemTimezone,
+        'eth': __systemEth,
+        'dns': __systemDns,
+        'sntp': __systemSntp,
+    }
+    # (port 1 ... port 4 are handled by __portOutlet)
+    PORT_COMMANDS = {
+        'list': __portList,
+        'setup': __portSetup,
+        'wd': __portWatchdog,
+    }
+
+
+class FakeNetio230aServerHandler(FakeKshellSession, socketserver.BaseRequestHandler):
 
     def send(self,message):
-        self.fakeserver.log(message+N_LINE_ENDING)
-        self.request.send((message+N_LINE_ENDING).encode('ascii'))
+        self.write([(0, encodeLines([message]))])
 
-    def receive(self):
-        return self.request.recv(1024)
+    def write(self, writes):
+        for pause, data in writes:
+            if pause > 0:
+                time.sleep(pause)
+            self.log(data.decode('ascii'))
+            self.request.sendall(data)
+            self.sent(data)
 
     def handle(self):
-        global fake_server
-        self.fakeserver = fake_server
-        device = fake_server.device
-        # First, we have to send the welcome message (including the salt for the md5 password hash):
-        salt = random.randint(0, 2**32-1)
-        self.send(N_WELCOME % salt)
-        # now we wait for incoming authentication requests:
-        auth = False
-        while not auth:
-            what_to_do = self.process(self.receive(),False)
-            if what_to_do[0] == 'quit':
-                break
-            if what_to_do[0] == 'invalid_login':
-                self.send(N_AUTH_ERR)
-            if what_to_do[0] == 'login':
-                if ADMIN_USERNAME == what_to_do[1] and ADMIN_PASSWORD == what_to_do[2]: auth = True
-            if what_to_do[0] == 'clogin':
-                md = hashlib.md5()
-                to_hash = ADMIN_USERNAME+ADMIN_PASSWORD+"%X" % salt
-                md.update(to_hash.encode("ascii"))
-                if md.hexdigest() ==  what_to_do[2]: auth = True
-            if what_to_do[0] in ['login','clogin']:
-                if auth:
-                    self.send(N_OK_L)
-                    break
-                else:
-                    self.send(N_AUTH_ERR)
-            if not what_to_do[0] in ['quit', 'invalid_login', 'login', 'clogin']:
-                self.send(N_FORB)
-        # now we serve all incoming requests:
-        while auth:
-            what_to_do = self.process(self.receive())
-            #pdb.set_trace()
-            if what_to_do[0] == 'port_list':
-                self.send(N_OK + ''.join([str(int(status)) for status in device.getOutlets()]))
-            if what_to_do[0] == 'port_setup':
-                outlet = device.outlets[what_to_do[1]-1]
-                self.send(N_OK + '"%s" %s %d %d' % (outlet.name, "timer" if outlet.timer.enabled else "manual", outlet.interrupt_delay, outlet.power_status_after_power_on) )
-            if what_to_do[0] == 'port_set':
-                device.setOutlet(what_to_do[1]-1,what_to_do[2])
-                self.send(N_OK_L)
-            if what_to_do[0] == 'unknown_command':
-                self.send(N_UNKNOWN)
-            if what_to_do[0] == 'invalid_parameter':
-                self.send(N_INV_P)
-            if what_to_do[0] == 'invalid_value':
-                self.send(N_INV_V)
-            if what_to_do[0] == 'already_authenticated':
-                self.send(N_ALR_AUTH)
-            if what_to_do[0] == 'version':
-                self.send(N_VER % device.version)
-            if what_to_do[0] == 'set_alias':
-                device.alias = what_to_do[1]
-                self.send(N_OK_L)
-            if what_to_do[0] == 'get_alias':
-                self.send(N_ALIAS % device.alias)
-            if what_to_do[0] == 'get_system_discover':
-                self.send(N_BOOLEAN % ("enable" if device.discover else "disable") )
-            if what_to_do[0] == 'set_system_discover':
-                device.discover = what_to_do[1]
-                self.send(N_OK_L)
-            if what_to_do[0] == 'get_system_swdelay':
-                self.send(N_SWDELAY % device.swdelay)
-            if what_to_do[0] == 'set_system_swdelay':
-                device.swdelay = what_to_do[1]
-                self.send(N_OK_L)
-            if what_to_do[0] == 'quit':
-                break
-        self.send(N_BYE)
-
-    # still unknown commands:
-    #port 1
-    #email server
-
-    def process(self,data,already_authenticated = True):
-        data = data.decode('ascii')
-        self.fakeserver.log(data+"\n")
-        data = data.strip()
-        if data == 'quit':
-            return ['quit']
-        if self.begins(data,'login') or self.begins(data,'clogin'):
-            if already_authenticated: return ['already_authenticated']
-            try:
-                fragments = data.split(' ')
-                username = fragments[1]
-                password_or_hash = fragments[2]
-            except:
-                return ['invalid_login']
-            return ['login' if self.begins(data,'login') else 'clogin',username,password_or_hash]
-        if data == 'version':
-            return ['version']
-        if data == 'alias':
-            return ['get_alias']
-        if self.begins(data,'alias '):
-            new_alias = data.split(' ')[1]
-            if len(new_alias) > N_ALIAS_LENGTH: return ['invalid_parameter']
-            return ['set_alias', new_alias]
-        if data == 'system discover':
-            return ['get_system_discover']
-        if self.begins(data,'system discover'):
-            try:
-                new = data.split(" ")[2][0]
-                if new == 'e': return ['set_system_discover', True]
-                if new == 'd': return ['set_system_discover', False]
-            except:
-                pass
-            return ['invalid_value']
-        if data == 'system swdelay':
-            return ['get_system_swdelay']
-        if self.begins(data,'system swdelay '):
-            try:
-                value = int(re.match("system swdelay ([0-9]*)", data).groups()[0])
-            except:
-                return ['invalid_value']
-            if value > N_MAX_SWDELAY: return ['invalid_value']
-            return ['set_system_swdelay', value]
-        if data == 'port list':
-            return ['port_list']
-        if self.begins(data,'port'):
-            try:
-                fragments = data.split(' ')
-                second_part = fragments[1]
-            except IndexError:
-                return ['invalid_parameter'] # this is what you get for the invalid command `port`
-            if second_part == 'setup':
-                pass
-                try:
-                   which = int(fragments[2])
-                   if not which in range(1,N_NUM_OUTLETS+1):
-                       raise InvPError
-                except InvPError:
-                    return ['invalid_parameter']
-                except IndexError:
-                    return ['invalid_parameter']
-                return ['port_setup',which]
-            elif len(second_part)==1:
+        if not self.startSession(self.server.device, self.server.log, self.server.capture):
+            # like the hardware we reset the connection of a second client:
+            self.request.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+            return
+        try:
+            self.request.settimeout(self.profile.idle_timeout)
+            # First, we have to send the welcome message (including the salt for the md5 password hash):
+            self.write(self.welcome())
+            while True:
                 try:
-                    which = int(second_part)
-                    if not which in range(1,N_NUM_OUTLETS+1):
-                        raise InvPError
-                    to = int(fragments[2])
-                    if not (to in [0,1]):
-                        raise InvVError
-                except InvVError:
-                    return ['invalid_value']
-                except InvPError:
-                    return ['invalid_parameter']
-                except ValueError:
-                    return ['invalid_parameter']
-                except IndexError:
-                    return ['port_get',which]
-                return ['port_set',which,bool(to)]
-        return ['unknown_command']
-
-    def begins(self,data,with_this):
-        return data[0:len(with_this)] == with_this
-
-class FakeNetio230aTimer(object):
-    enabled = False
-    mode = 0 # once (0), daily (1), weekly (2)
-    on_time = None
-    off_time = None
-    week_schedule = [True for i in range(7)] # set the timer for the day of week
-
-class FakeNetio230aWatchdog(object):
-    enabled = False
-    ip = "0.0.0.0"
-    timeout = 9 # ping command timeout [in seconds]
-    power_on_delay = 60 # time for which the Watchdog will be inactive after the output restarts [in seconds]
-    ping_interval = 3 # interval between ping commands [in seconds]
-    max_retry = 3 # how many times should be the output restarted
-    retry_power_off = False # keep the output OFF after Max retry limit is reached
-    send_email = False # send an email after power cycle and when max retry is reached
-
-class FakeNetio230aOutlet(object):
-    power_status = False
-    power_status_after_power_on = False #default output state after power on
-    name = "outlet x"
-    timer = FakeNetio230aTimer()
-    watchdog = FakeNetio230aWatchdog()
-    interrupt_delay = 5 # seconds
-
-class FakeNetio230a(object):
-    ### Artificial addons of the fakeserver:
-    logging = False
-    ### implicit properties of the device:
-    outlets = [ FakeNetio230aOutlet() for i in range(N_NUM_OUTLETS)]
-    ### Configuration as listed on /system.htm
-    ip = "192.168.1.101"
-    subnet = "255.255.255.0"
-    gateway = "192.168.1.1"
-    dns = "192.168.1.1"
-    dhcp_mode = False
-    swdelay = 15 # Switch delay (x0.1s): delay between triggering two outputs
-    system_messages = True
-    kshell_network_mode = True # If True listens to the network if False listens on the RS232 interface
-    kshell_port = 1234
-    web_port = 80
-    alias = "Zarathustra"
-    version = "2.33"
-    #### hidden system configurations:
-    discover = True
-    ### Date & time as listed on /timesetup.htm
-    up_since = datetime.datetime.now()
-    sntp_enabled = True
-    sntp_synchronized = False
-    sntp_server = "ntp.pool.org"
-    timezone = 7200 # Local time offset in minutes
-    #Daylight saving time: 	Enable Disable
-    #Daylight saving time begin: 	- -   ::
-    #Daylight saving time end:
-    ### E-mail configuration as listed on /email.htm
-    email_from = "mail@example.com"
-    email_to = "mail@example.com"
-    email_smtp_server = "smtp.example.com"
-    email_subject = "Email from NETIO230A"
-    
+                    data = self.request.recv(READ_CHUNK_SIZE)
+                except socket.timeout:
+                    self.write(self.idleTimeout())
+                    return
+                if len(data) == 0: return
+                writes, close = self.receiveData(data)
+                self.write(writes)
+                if close: return
+        finally:
+            self.endSession()
+
+class FakeSettings(object):
+    """ Base class of the (slotted) parts of the state of a fake device. The attributes
+    and their default values are listed in DEFAULTS. They can be given as keyword
+    arguments or as a configuration dict (see fromConfig() and toConfig()). """
+    __slots__ = ()
+    DEFAULTS = {}
+
+    def __init__(self, **settings):
+        unknown = set(settings) - set(self.DEFAULTS)
+        if unknown:
+            raise NameError("Unknown settings for %s: %s" % (type(self).__name__, ", ".join(sorted(unknown))))
+        for name, default in self.DEFAULTS.items():
+            # copied so that no two devices share a mutable default (like a list)
+            setattr(self, name, copy.copy(settings.get(name, default)))
+
+    @classmethod
+    def fromConfig(cls, config):
+        """ creates the object from a dict (or returns config if it already is one) """
+        if config is None:
+            return cls()
+        if isinstance(config, cls):
+            return config
+        return cls(**config)
+
+    def toConfig(self):
+        return dict([(name, copy.copy(getattr(self, name))) for name in self.DEFAULTS])
+
+class FakeNetio230aProfile(FakeSettings):
+    """ How (badly) a fake device behaves on the network. All random decisions are taken
+    from a random number generator seeded with seed, so a run can be replayed. The
+    defaults describe a fast and reliable device. """
+    DEFAULTS = {
+        'seed': None,
+        'delay': 0.0, # the (mean) time it takes to answer a command [in seconds]
+        'jitter': 0.0, # the spread of the delay [in seconds]
+        'distribution': "uniform", # of the delay: constant, uniform (delay +- jitter), normal (standard deviation jitter) or exponential
+        'coalesce_probability': 1.0, # the answers to pipelined commands are written at once (instead of one by one)
+        'split_probability': 0.0, # an answer is written in two parts
+        'split_delay': 0.001, # the pause between the two parts [in seconds]
+        'timeout_probability': 0.0, # 130 CONNECTION TIMEOUT (and disconnect) instead of an answer
+        'idle_timeout': None, # connections idle for so long are closed with a 130 CONNECTION TIMEOUT [in seconds]
+        'single_session': False, # the hardware resets the connection of a second client
+        'crash_probability': 0.0, # the telnet server crashes and answers everything with 502 UNKNOWN COMMAND until a reboot
+    }
+    __slots__ = tuple(DEFAULTS) + ('random',)
+
+    def __init__(self, **settings):
+        FakeSettings.__init__(self, **settings)
+        self.random = random.Random(self.seed)
+
+    @property
+    def faulty(self):
+        """ False if the device never crashes or times out (so nothing needs to be rolled for an answer) """
+        return self.crash_probability > 0 or self.timeout_probability > 0
+
+    @property
+    def immediate(self):
+        """ True if all answers are written at once without any delay """
+        return self.delay <= 0 and self.jitter <= 0 and self.split_probability <= 0 and self.coalesce_probability >= 1
+
+    def roll(self, name):
+        """ True with the probability given by the setting name """
+        probability = getattr(self, name)
+        if probability <= 0: return False
+        if probability >= 1: return True
+        return self.random.random() < probability
+
+    def responseDelay(self):
+        if self.distribution == "exponential":
+            return self.random.expovariate(1.0/self.delay) if self.delay > 0 else 0.0
+        if self.jitter <= 0 or self.distribution == "constant":
+            return self.delay
+        if self.distribution == "uniform":
+            return max(0.0, self.random.uniform(self.delay-self.jitter, self.delay+self.jitter))
+        if self.distribution == "normal":
+            return max(0.0, self.random.gauss(self.delay, self.jitter))
+        raise NameError("Unknown delay distribution: %s" % self.distribution)
+
+    def schedule(self, answers):
+        """ returns the writes (a list of (pause, bytes)) for a list of answers (each a list of lines) """
+        if self.immediate:
+            return [(0.0, encodeLines([line for lines in answers for line in lines]))] if answers else []
+        writes = [(self.responseDelay(), encodeLines(lines)) for lines in answers]
+        if len(writes) > 1 and self.roll('coalesce_probability'):
+            writes = [(sum([pause for pause, data in writes]), b"".join([data for pause, data in writes]))]
+        if self.split_probability <= 0:
+            return writes
+        split = []
+        for pause, data in writes:
+            if len(data) > 1 and self.roll('split_probability'):
+                cut = self.random.randint(1, len(data)-1)
+                split += [(pause, data[:cut]), (self.split_delay, data[cut:])]
+            else:
+                split.append((pause, data))
+        return split
+
+class FakeNetio230aTimer(FakeSettings):
+    DEFAULTS = {
+        'enabled': False,
+        'mode': 0, # once (0), daily (1), weekly (2)
+        'on_time': None,
+        'off_time': None,
+        'week_schedule': [True for i in range(7)], # set the timer for the day of week
+    }
+    __slots__ = tuple(DEFAULTS)
+
+class FakeNetio230aWatchdog(FakeSettings):
+    DEFAULTS = {
+        'enabled': False,
+        'ip': "0.0.0.0",
+        'timeout': 9, # ping command timeout [in seconds]
+        'power_on_delay': 60, # time for which the Watchdog will be inactive after the output restarts [in seconds]
+        'ping_interval': 3, # interval between ping commands [in seconds]
+        'max_retry': 3, # how many times should be the output restarted
+        'retry_power_off': False, # keep the output OFF after Max retry limit is reached
+        'send_email': False, # send an email after power cycle and when max retry is reached
+    }
+    __slots__ = tuple(DEFAULTS)
+
+class FakeNetio230aOutlet(FakeSettings):
+    DEFAULTS = {
+        'power_status': False,
+        'power_status_after_power_on': False, #default output state after power on
+        'name': "outlet x",
+        'interrupt_delay': 5, # seconds
+    }
+    __slots__ = tuple(DEFAULTS) + ('timer', 'watchdog', 'transitions')
+
+    def __init__(self, timer=None, watchdog=None, **settings):
+        FakeSettings.__init__(self, **settings)
+        self.timer = FakeNetio230aTimer.fromConfig(timer)
+        self.watchdog = FakeNetio230aWatchdog.fromConfig(watchdog)
+        # switching still to come as a sorted list of (time.monotonic(), power status):
+        self.transitions = []
+
+    def powerStatus(self, now=None):
+        """ returns the power status at the (monotonic) time now, applying the transitions due until then
+        (so an interrupted outlet needs no timer thread to get switched on again) """
+        if self.transitions:
+            if now is None: now = time.monotonic()
+            while self.transitions and self.transitions[0][0] <= now:
+                self.power_status = self.transitions.pop(0)[1]
+        return self.power_status
+
+    def switch(self, to):
+        """ switches immediately (cancelling any pending transition) """
+        self.transitions = []
+        self.power_status = bool(to)
+
+    def schedule(self, when, to):
+        bisect.insort(self.transitions, (when, bool(to)))
+
+    def interrupt(self, when):
+        """ inverts the power status at when for interrupt_delay seconds """
+        # the status the outlet ends up in after the switching still to come:
+        status = self.transitions[-1][1] if self.transitions else self.power_status
+        self.schedule(when, not status)
+        self.schedule(when + self.interrupt_delay, status)
+
+    def toConfig(self):
+        config = FakeSettings.toConfig(self)
+        config['timer'] = self.timer.toConfig()
+        config['watchdog'] = self.watchdog.toConfig()
+        return config
+
+class FakeNetio230a(FakeSettings):
+    """ The state of a fake device. Every object has its own state, e.g.
+        FakeNetio230a.fromConfig({'alias': "rack-7", 'outlets': [{'name': "router", 'power_status': True}]})
+    (outlets not given in the configuration get the default settings). """
+    DEFAULTS = {
+        ### Configuration as listed on /system.htm
+        'ip': "192.168.1.101",
+        'subnet': "255.255.255.0",
+        'gateway': "192.168.1.1",
+        'dns': "192.168.1.1",
+        'dhcp_mode': False,
+        'swdelay': 15, # Switch delay (x0.1s): delay between triggering two outputs
+        'system_messages': True,
+        'kshell_network_mode': True, # If True listens to the network if False listens on the RS232 interface
+        'kshell_port': 1234,
+        'web_port': 80,
+        'alias': "Zarathustra",
+        'version': "2.33",
+        #### hidden system configurations:
+        'discover': True,
+        'telnet_crashed': False,
+        ### Date & time as listed on /timesetup.htm
+        'up_since': None, # defaults to the creation of the object
+        'sntp_enabled': True,
+        'sntp_synchronized': False,
+        'sntp_server': "ntp.pool.org",
+        'timezone': 7200, # Local time offset [in seconds]
+        'clock_offset': 0.0, # how far the clock of the device is ahead of the local time [in seconds]
+        #Daylight saving time: 	Enable Disable
+        #Daylight saving time begin: 	- -   ::
+        #Daylight saving time end:
+        ### E-mail configuration as listed on /email.htm
+        'email_from': "mail@example.com",
+        'email_to': "mail@example.com",
+        'email_smtp_server': "smtp.example.com",
+        'email_subject': "Email from NETIO230A",
+    }
+    __slots__ = tuple(DEFAULTS) + ('outlets', 'profile', 'sessions', 'replay')
+
+    def __init__(self, outlets=None, profile=None, replay=None, **settings):
+        FakeSettings.__init__(self, **settings)
+        self.profile = FakeNetio230aProfile.fromConfig(profile)
+        # a capture.Replay to answer with instead of emulating the KSHELL:
+        self.replay = replay
+        # the number of connected clients:
+        self.sessions = 0
+        if self.up_since is None:
+            self.up_since = datetime.datetime.now()
+        ### implicit properties of the device:
+        outlets = list(outlets or [])
+        if len(outlets) > N_NUM_OUTLETS:
+            raise NameError("The NETIO-230A has only %d outlets." % N_NUM_OUTLETS)
+        outlets += [None] * (N_NUM_OUTLETS - len(outlets))
+        self.outlets = [FakeNetio230aOutlet.fromConfig(outlet) for outlet in outlets]
+
+    def toConfig(self):
+        config = FakeSettings.toConfig(self)
+        config['outlets'] = [outlet.toConfig() for outlet in self.outlets]
+        config['profile'] = self.profile.toConfig()
+        return config
+
     def setOutlet(self, which, to):
-        self.outlets[which].power_status = bool(to)
+        self.outlets[which].switch(to)
+    def getOutlet(self, which):
+        return self.outlets[which].powerStatus()
     def getOutlets(self):
-        return [outlet.power_status for outlet in self.outlets]
+        now = time.monotonic()
+        return [outlet.powerStatus(now) for outlet in self.outlets]
+
+    def setOutlets(self, states):
+        """ switches the outlets as given by a `port list` string (0: off, 1: on, i: interrupt, u: unchanged)
+        one after the other with swdelay in between like the hardware """
+        when = time.monotonic()
+        first = True
+        for outlet, state in zip(self.outlets, states):
+            if state == 'u':
+                continue
+            if not first:
+                when += self.swdelay / 10.0
+            first = False
+            if state == 'i':
+                outlet.interrupt(when)
+            elif when <= time.monotonic():
+                outlet.switch(state == '1')
+            else:
+                outlet.schedule(when, state == '1')
+
+    def interruptOutlet(self, which):
+        self.outlets[which].interrupt(time.monotonic())
+
+    def getTime(self):
+        return datetime.datetime.now() + datetime.timedelta(seconds=self.clock_offset)
+    def setTime(self, dt):
+        self.clock_offset = (dt - datetime.datetime.now()).total_seconds()
+
+    def getUptime(self):
+        return datetime.datetime.now() - self.up_since
+
+    def reboot(self):
+        """ restarts the firmware: the outlets keep their power status (pending switching is lost) """
+        now = time.monotonic()
+        for outlet in self.outlets:
+            outlet.switch(outlet.powerStatus(now))
+        self.telnet_crashed = False
+        self.up_since = datetime.datetime.now()
 
 
 class FakeNetio230aServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
 
-    def __init__(self, server_address, RequestHandlerClass,logfile_name=""):
+    # don't let connections left open by clients block the shutdown of the server:
+    daemon_threads = True
+    block_on_close = False
 
-        global fake_server
-        #if fake_server is not None: raise NameError("Can only start a single instance of the FakeServer")
-        fake_server = self
+    def __init__(self, server_address, RequestHandlerClass,logfile_name="",device=None,capture=None):
+        """ device is the FakeNetio230a to simulate (or its configuration dict),
+        capture an optional capture.CaptureWriter recording all sessions """
 
-        self.device = FakeNetio230a()
+        self.device = FakeNetio230a.fromConfig(device)
+        self.capture = capture
+        self.logging = False
         ### Seems like we don't really need this line (at least with Python 2.7 on Mac OS X):
         self.allow_reuse_address = True
         ## with Python 3 we would use something like:
@@ -324,7 +803,7 @@ class FakeNetio230aServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
         if self.logging: self.logfile.write(message)
 
 
-import socket, signal
+import signal
 class NetcatClientConnectionClosed(Exception):
     pass
 class AlarmException(Exception):
@@ -359,8 +838,7 @@ class NetcatClient(object):
         self.connected = False
 
 def start_fakeserver(tcp_port, start_client, logfile):
-    global fake_server
-    FakeNetio230aServer(("", tcp_port), FakeNetio230aServerHandler,logfile)
+    fake_server = FakeNetio230aServer(("", tcp_port), FakeNetio230aServerHandler,logfile)
     fake_server_ip, fake_server_port = fake_server.server_address
     print("Fake Netio230A server reachable on 'localhost' on port %i" % fake_server_port)
     if start_client:
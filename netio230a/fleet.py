@@ -0,0 +1,117 @@
+#
+# -*- encoding: UTF8 -*-
+
+
+#   This file is part of netio230a.
+#
+#   netio230a is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   netio230a is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with netio230a.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Run commands on many NETIO-230A devices at once.
+"""
+
+import asyncio
+import time
+from collections import namedtuple
+
+from .asyncclient import AsyncNetio230a
+
+# how many devices we talk to at the same time by default:
+MAX_CONCURRENT_DEVICES = 64
+# the time one operation on a single device may take at most [in seconds]:
+DEVICE_OPERATION_TIMEOUT = 10.0
+
+FleetDevice = namedtuple('FleetDevice', ['name', 'host', 'port', 'username', 'password'])
+# value is the return value of the operation, error the exception it raised (or None), elapsed the time in seconds
+FleetResult = namedtuple('FleetResult', ['device', 'value', 'error', 'elapsed'])
+
+
+class Fleet(object):
+    """A Fleet keeps one logged-in AsyncNetio230a session per device and runs operations
+    on all of them (or a subset) concurrently:
+
+        fleet = Fleet.fromConfiguration()
+        for result in await fleet.run("getPowerSocketList"):
+            print(result.device.name, result.value, result.error, result.elapsed)
+        await fleet.run("setPowerSocketPower", 3, False)
+        await fleet.close()
+
+    The whole run takes about as long as the slowest device (as long as there are
+    no more devices than the concurrency limit)."""
+
+    def __init__(self, devices, secureLogin=True, concurrency=MAX_CONCURRENT_DEVICES, timeout=DEVICE_OPERATION_TIMEOUT):
+        """devices is an iterable of (name, host, port, username, password) entries"""
+        self.devices = [FleetDevice(*device) for device in devices]
+        self.secureLogin = secureLogin
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.__clients = {}
+
+    @classmethod
+    def fromConfiguration(cls, configuration=None, **kwargs):
+        """creates a Fleet from the stored connections (see configuration.getConfiguration())
+        Hosts given by the name of a discovered device are resolved through the inventory."""
+        from . import configuration as config
+        if configuration is None:
+            configuration = config.getConfiguration()
+        return cls([(row[0], config.resolveHost(row[1])) + tuple(row[2:5]) for row in configuration], **kwargs)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def client(self, device):
+        """returns the (persistent) session for device"""
+        key = (device.host, device.port, device.username)
+        if key not in self.__clients:
+            self.__clients[key] = AsyncNetio230a(device.host, device.username, device.password, self.secureLogin, device.port)
+        return self.__clients[key]
+
+    async def run(self, operation, *args, **kwargs):
+        """runs operation on every device and returns a list of FleetResult (in the order of the devices).
+
+        operation is either the name of a method of AsyncNetio230a (called with *args and **kwargs)
+        or a coroutine function that gets the session as first argument: operation(client, *args, **kwargs)
+        (with the keyword argument with_device=True it also gets the FleetDevice: operation(client, device, *args, **kwargs)).
+        A subset of the devices can be selected with the keyword argument devices=[...]."""
+        devices = kwargs.pop('devices', None)
+        with_device = kwargs.pop('with_device', False)
+        if devices is None:
+            devices = self.devices
+        semaphore = asyncio.Semaphore(self.concurrency)
+        async def run_on(device):
+            async with semaphore:
+                start = time.monotonic()
+                try:
+                    client = self.client(device)
+                    if callable(operation) and with_device:
+                        call = operation(client, device, *args, **kwargs)
+                    elif callable(operation):
+                        call = operation(client, *args, **kwargs)
+                    else:
+                        call = getattr(client, operation)(*args, **kwargs)
+                    value = await asyncio.wait_for(call, self.timeout)
+                    return FleetResult(device, value, None, time.monotonic() - start)
+                except Exception as error:
+                    return FleetResult(device, None, error, time.monotonic() - start)
+        return await asyncio.gather(*[run_on(device) for device in devices])
+
+    async def close(self):
+        """logs out of all devices"""
+        clients = list(self.__clients.values())
+        self.__clients = {}
+        await asyncio.gather(*[client.disconnect() for client in clients], return_exceptions=True)
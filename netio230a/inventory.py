@@ -0,0 +1,164 @@
+#
+# -*- encoding: UTF8 -*-
+
+
+#   This file is part of netio230a.
+#
+#   netio230a is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   netio230a is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with netio230a.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+An on-disk inventory of the NETIO-230A devices found by the discovery.
+
+The devices are stored by their MAC address so that a device keeps its entry when it
+gets a new IP address. Looking up a device is served from the inventory file without
+any network traffic; refresh() (or refreshInBackground()) merges the results of a new
+discovery into it:
+
+    host = netio230a.inventory.resolve("netio-lab")
+"""
+
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+from .configuration import SharedFile
+from .netio230a import iter_netio230a_devices, sweep_netio230a_devices, DETECTION_TIMEOUT
+
+INVENTORY_FILE = os.path.expanduser("~/.netio230a/inventory.json")
+# entries not refreshed for so long are considered stale [in seconds]:
+INVENTORY_MAX_AGE = 3600.
+
+# last_seen is given in seconds since the epoch, answer_time in ms
+InventoryEntry = namedtuple('InventoryEntry', ['mac', 'name', 'ip', 'netmask', 'gateway', 'last_seen', 'answer_time'])
+
+
+def formatAddress(address):
+    return ".".join([str(byte) for byte in address])
+
+def formatMac(mac):
+    return ":".join(["%02X" % byte for byte in mac])
+
+def entryFromDevice(device, last_seen=None):
+    """ converts a device as found by the discovery ([deviceName, ip, sm, gw, mac, answerTime]) """
+    return InventoryEntry(formatMac(device[4]), device[0], formatAddress(device[1]), formatAddress(device[2]),
+                          formatAddress(device[3]), time.time() if last_seen is None else last_seen, device[5])
+
+
+def _loadInventory(infile):
+    entries = {}
+    for data in json.load(infile)['devices']:
+        entry = InventoryEntry(**data)
+        entries[entry.mac] = entry
+    return entries
+
+def _dumpInventory(entries, outfile):
+    json.dump({'devices': [entry._asdict() for entry in entries.values()]}, outfile, indent=1)
+
+
+class Inventory(object):
+
+    def __init__(self, path=INVENTORY_FILE, max_age=INVENTORY_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        # the entries {mac: InventoryEntry}:
+        self.__file = SharedFile(path, _loadInventory, _dumpInventory, dict)
+        # guards the refresh thread:
+        self.__lock = threading.Lock()
+        self.__refresh_thread = None
+
+    def devices(self):
+        """ returns the list of all known devices (InventoryEntry), most recently seen first """
+        with self.__file.loaded() as entries:
+            return sorted(entries.values(), key=lambda entry: entry.last_seen, reverse=True)
+
+    def get(self, mac):
+        with self.__file.loaded() as entries:
+            return entries.get(mac.upper())
+
+    def lookup(self, name):
+        """ returns the entry for a device name, MAC or IP address (or None if unknown) """
+        for entry in self.devices():
+            if name in (entry.name, entry.ip) or name.upper() == entry.mac:
+                return entry
+        return None
+
+    def resolve(self, name):
+        """ returns the IP address of the device called name (or name itself if it is unknown) """
+        entry = self.lookup(name)
+        return name if entry is None else entry.ip
+
+    def stale(self):
+        """ True if the inventory is empty or wasn't refreshed within max_age """
+        devices = self.devices()
+        return len(devices) == 0 or time.time() - devices[0].last_seen > self.max_age
+
+    def update(self, devices):
+        """ merges the devices found by a discovery into the inventory (and stores it)
+        returns the list of the new or changed entries """
+        now = time.time()
+        changed = []
+        with self.__file.locked() as entries:
+            for device in devices:
+                entry = entryFromDevice(device, now)
+                old = entries.get(entry.mac)
+                if old is None or old[1:5] != entry[1:5]:
+                    changed.append(entry)
+                entries[entry.mac] = entry
+            if len(devices) > 0:
+                self.__file.save()
+        return changed
+
+    def forget(self, mac):
+        with self.__file.locked() as entries:
+            if entries.pop(mac.upper(), None) is not None:
+                self.__file.save()
+
+    def refresh(self, timeout=DETECTION_TIMEOUT, networks=None):
+        """ runs a broadcast discovery listening for timeout seconds (or a unicast sweep
+        of networks if given) and merges the results into the inventory
+        returns the list of the new or changed entries """
+        if networks is None:
+            devices = iter_netio230a_devices(timeout)
+        else:
+            devices = sweep_netio230a_devices(networks)
+        return self.update(list(devices))
+
+    def refreshInBackground(self, timeout=DETECTION_TIMEOUT, networks=None):
+        """ starts refresh() in a thread (unless one is running already) and returns the thread """
+        with self.__lock:
+            if self.__refresh_thread is not None and self.__refresh_thread.is_alive():
+                return self.__refresh_thread
+            self.__refresh_thread = threading.Thread(target=self.__refresh, args=(timeout, networks))
+            # not a daemon: the discovery is short and we want its results to be stored
+            self.__refresh_thread.start()
+            return self.__refresh_thread
+
+    def __refresh(self, timeout, networks):
+        try:
+            self.refresh(timeout, networks)
+        except Exception:
+            # the inventory stays as it is
+            pass
+
+
+# the inventory shared by the whole process:
+default_inventory = Inventory()
+
+def resolve(name):
+    """ returns the IP address of the device called name according to the default_inventory
+    (or name itself if it is unknown) """
+    return default_inventory.resolve(name)
@@ -54,49 +54,50 @@
 import socket
 # For a better handling of socket communication (Is data available? Or the socket closed?):
 import select
-# We also need threads to watch the socket for FINs (remote disconnects)
+# to block until the socket becomes readable (epoll/kqueue/poll where available):
+import selectors
+# for the I/O thread sending the queued requests of all threads:
 import threading
-# for md5 checksum:
-try:
-    import hashlib
-except ImportError:
-    # for Python << 2.5
-    import md5
-# for RegularExpressions:
-import re
+import queue
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
 ## for debugging (set debug mark with pdb.set_trace() )
 #import pdb
-# for math.ceil()
-import math
-# for shlex.shlex() (to parse answers from the NETIO 230A)
-import shlex
-# for errno codes (cf. <http://docs.python.org/library/errno.html>)
-import errno
 
 import time
+# for the binary discovery replies and the interface list:
+import struct
 ### for date.today()
 #from datetime import date
-from datetime import datetime, timedelta
+from datetime import datetime
+
+from .protocol import KshellProtocol, describeConnectionError, OUTLET_STATE_REQUESTS
+from .state import DeviceSnapshot
 
 TELNET_LINE_ENDING = "\r\n"
 TELNET_SOCKET_TIMEOUT = 5
-INITIAL_WAIT_FOR_OTHER_REQUEST = 0.013 # 13 ms to wait for other requests to terminate (later requests use the mean request time)
+INITIAL_WAIT_FOR_OTHER_REQUEST = 0.013 # 13 ms as initial guess for the mean request time
 #ANTI_FLOODING_WAIT = 0.001 # wait 1 ms before sending the next request (after having received the last response)
 ANTI_FLOODING_WAIT = 0.0
-MAX_NUMBER_OF_REQUESTS_BEFORE_RECONNECT = 500
-# The time we wait until we start monitoring the status of the socket
-WATCH_SOCKET_WAIT = 10.
-WATCH_WAKE_TIME = 0.2
 MAX_SECONDS_WAIT_FOR_RECEIVE = 1.0
 MAX_SECONDS_WAIT_FOR_RECEIVE_HELLO = MAX_SECONDS_WAIT_FOR_RECEIVE * 3
-TIMES_WAIT_FOR_RECEIVE = 100
+# the I/O thread stops after having nothing to do for so long [in seconds]:
+WORKER_IDLE_TIMEOUT = 5.
+# how long the responses to these requests stay valid in the cache [in seconds] (see netio230a.enableCache()):
+CACHE_TTL = {
+    'port list':       1.,
+    'port setup':      60.,
+    'alias':           300.,
+    'version':         float('inf'),
+    'system swdelay':  300.,
+    'system timezone': 300.,
+}
 
 class netio230a(object):
     """netio230a is the basic class that you want to instantiate when communicating
     with the Koukaam NETIO 230A. It can handle the raw TCP socket connection and
     helps you send the commands to switch on / off powerSockets etc."""
 
-    def __init__(self, host, username, password, secureLogin=False, customTCPPort=23):
+    def __init__(self, host, username, password, secureLogin=False, customTCPPort=23, capture=None):
         """netio230a constructor: set up an instance of netio230a by giving:
 
             host        the hostname of the NETIO-230A (may be in the form of something.dyndns.org or 192.168.1.2)
@@ -104,9 +105,22 @@ class netio230a(object):
             password    the password (that belongs to username)
             secureLogin bool value specifying whether to use a hashed or a cleartext login. True is hightly recommended for insecure networks!
             customTCPPort  integer specifying which port to connect to, defaul: 23 (NETIO-230A must be reachable via KSHELL/telnet via hostname:customTCPPort)
+            capture     an optional capture.CaptureWriter recording the traffic (every connection as a session)
         """
         self.logging = False
+        self.__capture = capture
+        self.__capture_session = None
+        # held by the I/O thread while talking to the device:
         self.__lock = threading.Lock()
+        # the requests waiting to be sent by the I/O thread (see submit()):
+        self.__queue = queue.Queue()
+        self.__worker = None
+        self.__worker_lock = threading.Lock()
+        # default deadline for the requests of the getters and setters (None: wait forever)
+        self.request_timeout = None
+        # the cached responses {request: (response, expiry time)} (None if the cache is disabled):
+        self.__cache = None
+        self.__cache_ttl = CACHE_TTL
         self.mean_request_time = INITIAL_WAIT_FOR_OTHER_REQUEST
         self.number_of_sent_requests = 0
         self.__last_request_received = time.time()
@@ -115,23 +129,24 @@ class netio230a(object):
         self.__password = password
         self.__secureLogin = secureLogin
         self.__tcp_port = customTCPPort
-        self.__bufsize = 1024
         self.__power_sockets = [ PowerSocket() for i in range(4) ]
         self.__create_socket_and_login()
 
-    def __create_socket_and_login(self, lock_already_acquired = False):
+    def __create_socket_and_login(self):
         # create a TCP/IP socket
         self.__s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.__s.settimeout(TELNET_SOCKET_TIMEOUT)
-        self.__login(lock_already_acquired)
-        # Create the thread that watches for timeouts of the NETIO230A TCP connection:
-        self.__watchSocketThread = threading.Timer(WATCH_SOCKET_WAIT, self.__watchSocket)
-        # When the rest of the program terminates, the thread should stop as well:
-        self.__watchSocketThread.daemon = True
-        self.__watchSocketThread.start()
+        self.__protocol = KshellProtocol(self.__username, self.__password, self.__secureLogin)
+        # the received data that wasn't handed out as a complete line yet:
+        self.__lines = self.__protocol.lines
+        if self.__capture is not None:
+            self.__capture_session = self.__capture.newSession()
+        self.__selector = selectors.DefaultSelector()
+        self.__selector.register(self.__s, selectors.EVENT_READ)
+        self.__login()
 
 
-    def __login(self, lock_already_acquired = False):
+    def __login(self):
         """Login to the server using the credentials given to the constructor.
            Note that this is a private method called by the constructor
            (so all connection details are set already)."""
@@ -141,100 +156,42 @@ class netio230a(object):
             # wait for the answer
             data = self.__receive( MAX_SECONDS_WAIT_FOR_RECEIVE_HELLO )
         except Exception as error:
-            if type(error) == socket.timeout:
-                raise NameError("Timeout while connecting to " + self.__host)
-                #print("There was a timeout")
-            elif type(error) == socket.gaierror or type(error) == socket.error and error.errno == errno.ENETUNREACH:
-                raise NameError("Unable to understand the host you gave: %s. Please provide a correct IP address or domain name." % self.__host)
-            elif type(error) == socket.error:
-                if error.errno == errno.ECONNREFUSED:
-                    raise NameError("The connection was refused by the remote host. Possible errors: wrong IP or wrong TCP port given or the telnet server on the NETIO-230A crashed.")
-                elif error.errno == errno.EHOSTUNREACH:
-                    raise NameError("There is no route to the host given: " + self.__host)
-                elif error.errno == errno.ECONNRESET:
-                    raise NameError("The connection was reset by the device. This is usually the case when you still have another network socket connected to the device. It may also be the case when the telnet server on the device crashed. In this case reboot the device (if possible & sensible).")
+            problem = describeConnectionError(error, self.__host)
             # in any other case just hand on the risen error:
-            raise error
-        except Exception as error:
-            raise error
-
-        # The answer should be in the form     "100 HELLO E675DDA5"
-        # where the last eight letters are random hexcode used to hash the password
-        if self.__reSearch("^100 HELLO [0-9A-F]{8}"+TELNET_LINE_ENDING+"$", data) == None and \
-           self.__reSearch("^100 HELLO [0-9A-F]{8} - KSHELL V1.."+TELNET_LINE_ENDING+"$", data) == None :
-            raise NameError("Error while connecting: Not received a \"100 HELLO ... signal from the remote device. Maybe not a NET-IO 230A?")
-        if self.__secureLogin:
-            hash=str(data).split(" ")[2]
-            msg=self.__username + self.__password + hash
-            # for md5 checksum:
-            try:
-                md = hashlib.md5()
-            except:
-                md = md5.new()
-            md.update(msg.encode("ascii"))
-            loginString = "clogin " + self.__username + " " + md.hexdigest() + TELNET_LINE_ENDING
-        else:
-            # use the password in cleartext
-            loginString = "login " + self.__username + " " + self.__password + TELNET_LINE_ENDING
+            if problem is None:
+                raise
+            raise NameError(problem)
+        loginString = self.__protocol.loginRequest(data)
         try:
             # send login string and wait for the answer
-            response = self.__sendRequest(loginString, True, lock_already_acquired)
-        except NameError as error:
-            self.disconnect()
-            try:
-                problem = str(error).partition('\n\n')[2]
-            except:
-                problem = "?"
-            if problem.find("502 UNKNOWN COMMAND") != -1:
-                raise NameError("Error while connecting: Login failed with message 502 UNKNOWN COMMAND. This is usually the case when the telnet server crashed. Reboot the NETIO-230A device to get it up running again.")
-            elif problem.find("501 INVALID PARAMETER") != -1:
-                raise NameError("Error while connecting: Login failed with message 501 INVALID PARAMETER. This is usually the case when the telnet server crashed. Reboot the NETIO-230A device to get it up running again.")
-            elif problem.find("504 ALREADY LOGGED IN") != -1:
-                raise NameError("You are already logged in. Something strange happened.")
-            else:
-                raise NameError("Error while connecting: Login failed; " + str(error).partition('\n\n')[2])
+            self.__send(self.__protocol.encodeRequests([loginString]))
+            self.__protocol.checkLogin(self.__receive())
+        except NameError:
+            # (the I/O thread may be holding the lock while logging in again)
+            self.__closeConnection()
+            raise
         except Exception as error:
-            self.disconnect()
+            self.__closeConnection()
             raise NameError("Error while connecting: Login failed; " + str(error))
 
-    def __watchSocket(self):
-        try:
-            assert self.__s
-            inputs = [self.__s]
-            outputs = [self.__s]
-            while True:
-                if ( time.time() - self.__last_request_received ) < WATCH_SOCKET_WAIT:
-                    time.sleep(WATCH_SOCKET_WAIT - (time.time()-self.__last_request_received))
-                else:
-                    time.sleep(WATCH_WAKE_TIME)
-                if not self.connected():
-                    continue
-                # If a request is pending, no action should be required:
-                if not self.__lock.acquire(False):
-                    continue
-                try:
-                    readable, writable, exceptional = select.select(inputs, outputs, inputs)
-                    # If the socket has something to be read (no blocking -
-                    # guaranteed) we want to know what strange thing this is:
-                    if self.__s in readable:
-                        answ = self.__s.recv(self.__bufsize)
-                        if self.__reSearch("^130 CONNECTION TIMEOUT", answ):
-                            self.log("The NETIO230A wants to close the connection due to a timeout. We'll respect that.")
-                        elif len(answ) == 0 :
-                            self.log("The NETIO230A has closed the connection. We do the same now.")
-                            break
-                        else:
-                            raise NameError("The NETIO230A sent a response when we didn't expect any: " + answ)
-                except:
-                    pass
-                finally:
-                    self.__lock.release()
-
-        finally:
-            self.__shutdownSocket()
-
-    def __reSearch(self, regexp, data):
-        return re.search(regexp.encode("ascii"), data)
+    def __checkForClosedConnection(self):
+        """Handles what the NETIO230A sent without being asked since the last request.
+        This is usually the 130 CONNECTION TIMEOUT message before it closes an idle connection."""
+        while self.__s and self.__waitReadable(0):
+            if self.__lines.receive(self.__s) == 0:
+                self.log("The NETIO230A has closed the connection. We do the same now.")
+                self.__shutdownSocket()
+                return
+            answ = self.__lines.readline()
+            while answ is not None:
+                if self.__protocol.isConnectionTimeout(answ):
+                    self.__captureResponse(answ)
+                    self.log("The NETIO230A wants to close the connection due to a timeout. We'll respect that.")
+                    self.__shutdownSocket()
+                    return
+                self.log("The NETIO230A sent a response when we didn't expect any: " + answ.decode("ascii"))
+                self.__captureResponse(answ)
+                answ = self.__lines.readline()
 
     def enable_logging(self, log_file):
         self.logging = True
@@ -260,45 +217,57 @@ class netio230a(object):
         'port list' returns a string (4 chars long) specifying which power sockets are switched on/off.
         Each char is representing the power status of one power socket: 0/1
         We convert them to a list of four boolean values: """
-        return [bool(int(status)) for status in self.__sendRequest("port list")]
+        return self.__protocol.parsePowerSocketList(self.__cachedRawRequest("port list"))
 
     def getPowerSocketSetup(self,power_socket):
         """Sends request to the NETIO 230A to ask for the setup of the power socket given as parameter.
         returns the "port setup" string as specifyed by Koukaam"""
-        return self.__sendRequest("port setup " + str(power_socket+1))
+        return self.__cachedRequest("port setup " + str(power_socket+1))
 
     def setPowerSocketPower(self,power_socket,switchOn=False):
         """setPowerSocketPower(power_socket,switchOn=False): method to set the power status of the power socket specified by the argument power_socket to the bool argument switchOn
         returns nothing"""
-        # the type conversion of switchOn ensures that the values are either "0" or "1":
-        self.__sendRequest("port " + str(power_socket) + " " + str(int(bool(int(switchOn)))) )
+        request = self.__protocol.powerSocketPowerRequest(power_socket, switchOn)
+        self.__sendRequest(request)
+        port_list = self.__fromCache("port list")
+        if port_list is not None:
+            index = int(power_socket) - 1
+            self.__updateCache("port list", port_list[:index] + request[-1].encode("ascii") + port_list[index+1:])
 
     def togglePowerSocketPower(self,power_socket):
         """togglePowerSocketPower(power_socket): toggles the power status of power socket specified by the (one based) argument power_socket.
         returns a boolean indicating the new status"""
-        previous_state = self.getPowerSocket(power_socket-1).getPowerOn() # the getPowerSocket() function has a zero based argument! therefore -1
+        previous_state = self.getPowerSocketList()[int(power_socket)-1]
         self.setPowerSocketPower(power_socket, not previous_state)
         return not previous_state
 
     def setPowerSocketTempInterrupt(self,power_socket):
         self.__sendRequest("port " + str(int(power_socket)) + " int" )
+        self.invalidateCache("port list")
 
     def setPowerSocketManualMode(self,power_socket,manualMode=True):
         self.__sendRequest("port " + str(int(power_socket)) + " manual")
+        self.invalidateCache("port setup " + str(int(power_socket)))
+
+    def keepAlive(self):
+        """Sends a harmless request so that the NETIO 230A doesn't close the idle connection."""
+        self.__sendRequest("version")
 
     def getFirmwareVersion(self):
-        return self.__sendRequest("version")
+        return self.__cachedRequest("version")
 
     def getDeviceAlias(self):
-        return self.__sendRequest("alias")
+        return self.__cachedRequest("alias")
 
     def setDeviceAlias(self,alias = "netio230a"):
         self.__sendRequest("alias " + alias)
+        self.__updateCache("alias", alias.encode("ascii"))
 
     # this command is operation-safe: it does not switch the power sockets on/off during reboot of the NETIO 230A
     def reboot(self):
+        self.invalidateCache()
         response = self.__sendRequest("reboot",False)
-        if re.search("^120 Rebooting", response) != None:
+        if response.startswith("120 Rebooting"):
             time.sleep(.05) # no reboot if disconnecting too soon
 
     def getWatchdogSettings(self,power_socket):
@@ -308,10 +277,7 @@ class netio230a(object):
         return self.__sendRequest("system eth")
 
     def setNetworkSettings(self,dhcpMode=False,deviceIP="192.168.1.2",subnetMask="255.255.255.0",gatewayIP="192.168.1.1"):
-        if dhcpMode:
-            self.__sendRequest("system eth dhcp")
-        else:
-            self.__sendRequest("system eth manual " + deviceIP + " " + subnetMask + " " + gatewayIP)
+        self.__sendRequest(self.__protocol.networkSettingsRequest(dhcpMode, deviceIP, subnetMask, gatewayIP))
 
     def getDnsServer(self):
         return self.__sendRequest("system dns")
@@ -320,10 +286,7 @@ class netio230a(object):
         self.__sendRequest("system dns " + dnsServer)
 
     def getSystemDiscoverableUsingTool(self):
-        if self.__sendRequest("system discover") == "enable":
-            return True
-        else:
-            return False
+        return self.__protocol.parseDiscoverable(self.__sendRawRequest("system discover"))
 
     def setSystemDiscoverableUsingTool(self,setDiscoverable=True):
         if setDiscoverable:
@@ -333,49 +296,40 @@ class netio230a(object):
         self.__sendRequest("system discover " + command)
 
     def setSwitchDelay(self,seconds):
-        return self.__sendRequest("system swdelay " + str(int(math.ceil(seconds*10.0))))
+        request = self.__protocol.switchDelayRequest(seconds)
+        response = self.__sendRequest(request)
+        self.__updateCache("system swdelay", request.rpartition(" ")[2].encode("ascii"))
+        return response
 
     def getSwitchDelay(self):
-        return int(self.__sendRequest("system swdelay"))/10.0
+        return self.__protocol.parseSwitchDelay(self.__cachedRawRequest("system swdelay"))
 
     def getSntpSettings(self):
         return self.__sendRequest("system sntp")
 
     def setSntpSettings(self,enable=True,sntpServer="time.nist.gov"):
-        if enable:
-            command = "enable"
-        else:
-            command = "disable"
-        self.__sendRequest("system sntp " + " " + sntpServer)
+        self.__sendRequest(self.__protocol.sntpSettingsRequest(enable, sntpServer))
 
     def setSystemTime(self,dt):
-        self.__sendRequest("system time " + dt.strftime("%Y/%m/%d,%H:%M:%S") )
+        self.__sendRequest(self.__protocol.systemTimeRequest(dt))
 
     def getSystemTime(self):
         """getSystemTime() returns a datetime object"""
-        formatedTimestring = self.__sendRequest("system time")
-        date = formatedTimestring.partition(",")[0].split("/")
-        time = formatedTimestring.partition(",")[2].split(":")
-        return datetime(int(date[0]), int(date[1]), int(date[2]), int(time[0]), int(time[1]), int(time[2]))
+        return self.__protocol.parseSystemTime(self.__sendRawRequest("system time"))
 
     def getSystemUptime(self):
         """getSystemUptime() returns a timedelta object"""
-        formatedTimestring = self.__sendRequest('uptime')
-        uptime_regex = r'^(?P<years>\d+) years (?P<days>\d+) days (?P<hours>\d+) hours (?P<min>\d+) min (?P<sec>\d+) sec$'
-
-        try:
-            g = re.search(uptime_regex, formatedTimestring).groupdict()
-            return timedelta(days=int(g['days']), hours=int(g['hours']), minutes=int(g['min']), seconds=int(g['sec']))
-        except AttributeError:
-            return False
+        return self.__protocol.parseSystemUptime(self.__sendRawRequest('uptime'))
 
     def getSystemTimezone(self):
         """getSystemTimezone() returns the timezone offset from UTC in hours of the NETIO-230A."""
-        return float(int(self.__sendRequest("system timezone")))/3600.0
+        return self.__protocol.parseSystemTimezone(self.__cachedRawRequest("system timezone"))
 
     def setSystemTimezone(self,hoursOffset):
         """setSystemTimezone(hoursOffset) sets the timezone offset from UTC in hours of the NETIO-230A."""
-        self.__sendRequest("system timezone " + str(math.ceil(hoursOffset*3600.0)))
+        request = self.__protocol.systemTimezoneRequest(hoursOffset)
+        self.__sendRequest(request)
+        self.__updateCache("system timezone", request.rpartition(" ")[2].encode("ascii"))
 
     def setPowerSocket(self,number,power_socket):
         self.__power_sockets[number] = power_socket
@@ -385,92 +339,193 @@ class netio230a(object):
         return self.__power_sockets[number]
 
     def getAllPowerSockets(self):
-        self.updatePowerSocketsStatus()
-        return self.__power_sockets
+        """returns a tuple of four (immutable) OutletState objects"""
+        return self.getDeviceSnapshot().outlets
+
+    def getDeviceSnapshot(self):
+        """returns a DeviceSnapshot with the state of all four power sockets"""
+        # one round trip for the power status and all four setups (or less if cached):
+        return DeviceSnapshot.create(self.__host, self.__protocol.parseOutletStates(self.__cachedRequests(OUTLET_STATE_REQUESTS)))
 
     def updatePowerSocketsStatus(self):
-        power_sockets = []
-        powerOnStatus = self.getPowerSocketList()
-        for i in range(4):
-            status_splitter = shlex.shlex(self.getPowerSocketSetup(i), posix=True)
-            status_splitter.whitespace_split = True
-            power_sockets.append( list(status_splitter) )
-            self.__power_sockets[i].setName(power_sockets[i][0])
-            self.__power_sockets[i].setPowerOnAfterPowerLoss(bool(int(power_sockets[i][3])))
-            self.__power_sockets[i].setPowerOn(powerOnStatus[i])
-            self.__power_sockets[i].setManualMode(power_sockets[i][1]=="manual")
-            self.__power_sockets[i].setInterruptDelay(int(power_sockets[i][2]))
+        for power_socket, outlet in zip(self.__power_sockets, self.getAllPowerSockets()):
+            power_socket.update(outlet)
             #still missing: setWatchdogOn
 
+    def enableCache(self, ttl=None):
+        """Enables the cache for the state of the NETIO 230A: the responses to the requests
+        listed in CACHE_TTL are reused until they expire. ttl is a dict overriding some of
+        the times to live given in CACHE_TTL, e.g. {'port list': 0.2}.
+        Our own set commands update the cache instead of invalidating it. Changes done by others
+        (the web interface, the buttons, timers or watchdogs of the device) show up only after the ttl."""
+        self.__cache_ttl = dict(CACHE_TTL)
+        self.__cache_ttl.update(ttl or {})
+        self.__cache = {}
+
+    def disableCache(self):
+        self.__cache = None
+
+    def invalidateCache(self, request=None):
+        """drops the cached response to request (or all cached responses if request is None)"""
+        if self.__cache is None: return
+        if request is None:
+            self.__cache.clear()
+        else:
+            self.__cache.pop(request, None)
+
+    def __cacheTTL(self, request):
+        if request.startswith("port setup "):
+            request = "port setup"
+        return self.__cache_ttl.get(request)
+
+    def __fromCache(self, request):
+        """returns the cached response to request or None if we don't have a valid one"""
+        if self.__cache is None: return None
+        response, expires = self.__cache.get(request, (None, 0))
+        if time.monotonic() >= expires:
+            return None
+        return response
+
+    def __updateCache(self, request, response):
+        if self.__cache is None: return
+        ttl = self.__cacheTTL(request)
+        if ttl is not None:
+            self.__cache[request] = (response, time.monotonic() + ttl)
+
+    def __cachedRequest(self, request):
+        return self.__cachedRawRequest(request).decode("ascii")
+
+    def __cachedRawRequest(self, request):
+        return self.__cachedRequests([request])[0]
+
+    def __cachedRequests(self, requests):
+        """like pipeline() but only sends the requests for which the cache has no valid response
+        (returns the undecoded responses, which is what the cache holds)"""
+        responses = [self.__fromCache(request) for request in requests]
+        missing = [request for request, response in zip(requests, responses) if response is None]
+        if len(missing) == 0:
+            return responses
+        fetched = dict(zip(missing, self.__sendRawRequests(missing)))
+        for request in missing:
+            self.__updateCache(request, fetched[request])
+        return [fetched[request] if response is None else response for request, response in zip(requests, responses)]
+
     def __assureConnection(self):
         try:
             assert self.__s
         except:
             self.log("Socket not ready. Reconnecting.")
             # try to reconnect:
-            self.__create_socket_and_login(True)
-
-    def __disconnectAfterLargeNumberOfRequests(self):
-        if MAX_NUMBER_OF_REQUESTS_BEFORE_RECONNECT > 0 and (self.number_of_sent_requests+1) % MAX_NUMBER_OF_REQUESTS_BEFORE_RECONNECT == 0:
-            self.number_of_sent_requests += 1
-            if not self.connected(): return
-            print("%d requests made, reconnecting..." % MAX_NUMBER_OF_REQUESTS_BEFORE_RECONNECT)
-            self.disconnect()
-
-    def __acquireLockWaitForOtherRequestsToFinish(self):
-        counter = 0
-        # in this loop we want to avoid errors for concurrent requests (from different threads etc.)
-        while True:
-            got_lock = self.__lock.acquire(False)
-            if got_lock:
-                return True
-            wait_time = self.mean_request_time*.5
-            time.sleep(wait_time)
-            counter += 1
-            print("concurrent action for request: %s" % request)
-            self.log("Waiting for an other request to finish. Average time for processes to finish is %.6f s after a total number of %d requests." % (self.mean_request_time, self.number_of_sent_requests) )
-            if counter * wait_time >= 3 * (self.mean_request_time + ANTI_FLOODING_WAIT):
-                # If we waited for too long, we give up.
-                raise NameError("Sorry, some other process is sending a request you cannot send yours now.")
-        return None
-
+            self.__create_socket_and_login()
 
     def __waitFloodingProtect(self):
             if ANTI_FLOODING_WAIT > 0.0005 and time.time()-self.__last_request_received < ANTI_FLOODING_WAIT:
                 time.sleep(ANTI_FLOODING_WAIT-(time.time()-self.__last_request_received))
 
+    def pipeline(self, requests, complainIfAnswerNot250=True, timeout=None):
+        """Sends several requests (a list of command strings) to the NETIO 230A at once
+        and returns the list of their responses in the same order.
+        All requests are written with a single send() so that the whole batch costs about one round trip."""
+        return self.__result(self.submit(requests, complainIfAnswerNot250, timeout), requests, timeout)
+
+    def submit(self, requests, complainIfAnswerNot250=True, timeout=None):
+        """Queues a list of requests for the NETIO 230A and returns immediately.
+        returns a concurrent.futures.Future which results in the list of responses.
+
+        Requests of all threads using this object are sent in the order they were submitted
+        by a single I/O thread. If they couldn't be sent within timeout seconds they fail with a NameError."""
+        return self.__submit(requests, complainIfAnswerNot250, timeout, True)
+
+    def __submit(self, requests, complainIfAnswerNot250, timeout, decode):
+        future = Future()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        self.__queue.put((list(requests), complainIfAnswerNot250, deadline, decode, future))
+        with self.__worker_lock:
+            if self.__worker is None:
+                self.__worker = threading.Thread(target=self.__processQueue)
+                # When the rest of the program terminates, the thread should stop as well:
+                self.__worker.daemon = True
+                self.__worker.start()
+        return future
+
+    def __processQueue(self):
+        """ the I/O thread: sends the queued requests one after the other """
+        while True:
+            try:
+                requests, complainIfAnswerNot250, deadline, decode, future = self.__queue.get(timeout=WORKER_IDLE_TIMEOUT)
+            except queue.Empty:
+                with self.__worker_lock:
+                    # stop when there is nothing to do (so that we don't keep this object alive forever):
+                    if self.__queue.empty():
+                        self.__worker = None
+                        return
+                continue
+            if not future.set_running_or_notify_cancel():
+                continue
+            if deadline is not None and time.monotonic() > deadline:
+                future.set_exception(NameError("The request '%s' couldn't be sent before its deadline." % "', '".join(requests)))
+                continue
+            try:
+                responses = self.__exchange(requests, complainIfAnswerNot250)
+                if decode:
+                    responses = [response.decode("ascii") for response in responses]
+                future.set_result(responses)
+            except Exception as error:
+                future.set_exception(error)
+
     # generic method to send requests to the NET-IO 230A and checking the response
-    def __sendRequest(self,request,complainIfAnswerNot250=True,lock_already_acquired=False):
-        if not lock_already_acquired:
-            assert self.__acquireLockWaitForOtherRequestsToFinish()
-        self.__disconnectAfterLargeNumberOfRequests()
-        self.__assureConnection()
+    def __sendRequest(self,request,complainIfAnswerNot250=True):
+        return self.__sendRawRequest(request, complainIfAnswerNot250).decode("ascii")
+
+    def __sendRawRequest(self,request,complainIfAnswerNot250=True):
+        return self.__sendRawRequests([request], complainIfAnswerNot250)[0]
+
+    def __sendRawRequests(self,requests,complainIfAnswerNot250=True):
+        """ returns the responses as bytes (as expected by the parsers of the protocol) """
+        return self.__result(self.__submit(requests, complainIfAnswerNot250, self.request_timeout, False), requests, self.request_timeout)
+
+    def __result(self, future, requests, timeout):
+        """ waits for the responses of submitted requests, raises NameError if they don't arrive within timeout seconds """
         try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise NameError("The request '%s' couldn't be sent within %.3f s (it won't be sent)." % ("', '".join(requests), timeout))
+            raise NameError("The request '%s' wasn't answered within %.3f s (it is being sent and may still take effect)."
+                            % ("', '".join(requests), timeout))
+
+    def __exchange(self,requests,complainIfAnswerNot250=True):
+        """ sends the requests and receives their responses (must only be called by the I/O thread) """
+        if len(requests) == 0:
+            return []
+        with self.__lock:
+            self.__checkForClosedConnection()
+            self.__assureConnection()
             self.__waitFloodingProtect()
             starting_time = time.time()
             try:
-                self.__send(request.encode("ascii")+TELNET_LINE_ENDING.encode("ascii"))
+                self.__send(self.__protocol.encodeRequests(requests))
             except Exception as error:
                 self.log("could not send the command: "+str(error))
-                raise NameError("Sending the command '%s' produced this error: %s." % (request, error))
-            try:
-                data = self.__receive()
-            except Exception as error:
-                # maybe we should try to reconnect here too before giving up.
-                self.log("trying to receive data failed: "+str(error))
-                raise NameError("trying to receive data failed: "+str(error))
-            if self.__reSearch("^250 ", data) == None and complainIfAnswerNot250:
-                raise NameError("Error while sending request: " + request + "\nresponse from NET-IO 230A is:  " + data.replace(TELNET_LINE_ENDING,''))
-            else:
-                data = data.decode("ascii")
-                data = data.replace("250 ","").replace(TELNET_LINE_ENDING,"")
-                self.mean_request_time = ( self.number_of_sent_requests*self.mean_request_time + (time.time()-starting_time) ) / (self.number_of_sent_requests + 1)
-                self.number_of_sent_requests += 1
-                self.__last_request_received = time.time()
-        finally:
-            if not lock_already_acquired:
-                self.__lock.release()
-        return data
+                raise NameError("Sending the command '%s' produced this error: %s." % ("', '".join(requests), error))
+            responses = []
+            for request in requests:
+                try:
+                    data = self.__receive()
+                except Exception as error:
+                    self.log("trying to receive data failed: "+str(error))
+                    # the late answers would be taken for the answers to the next requests,
+                    # so we start over with a new connection:
+                    if self.__s:
+                        self.__shutdownSocket()
+                    raise NameError("trying to receive data failed: "+str(error))
+                responses.append(data)
+            # we check the responses only after having received all of them to stay in sync with the device:
+            responses = [self.__protocol.parseResponse(request, data, complainIfAnswerNot250) for request, data in zip(requests, responses)]
+            self.mean_request_time = ( self.number_of_sent_requests*self.mean_request_time + (time.time()-starting_time) ) / (self.number_of_sent_requests + len(requests))
+            self.number_of_sent_requests += len(requests)
+            self.__last_request_received = time.time()
+        return responses
 
     def connected(self):
         if not self.__s: return False
@@ -480,17 +535,17 @@ class netio230a(object):
         return True
 
     def disconnect(self):
+        # wait for the request being sent right now (if any):
+        with self.__lock:
+            self.__closeConnection()
+
+    def __closeConnection(self):
+        """ says goodbye and closes the connection (without taking the lock) """
         if not self.connected(): return
-        try:
-            self.__watchSocketThread.cancel()
-        except:
-            pass
         try:
             # send the quit command to the box (if we have an open connection):
             self.__send("quit".encode("ascii")+TELNET_LINE_ENDING.encode("ascii"))
             self.__receive()  # should give  110 BYE
-        except Exception as error:
-            raise error
         finally:
             self.__shutdownSocket()
 
@@ -507,7 +562,13 @@ class netio230a(object):
                 self.__s.close()
             except:
                 pass
+            try:
+                self.__selector.close()
+            except:
+                pass
         self.__s = None
+        if self.__capture is not None:
+            self.__capture.closed(self.__capture_session)
 
     def __del__(self):
         try:
@@ -518,26 +579,43 @@ class netio230a(object):
     def __send(self, data):
         self.log(data, False)
         self.__s.send(data)
+        if self.__capture is not None:
+            for request in data.decode("ascii").split(TELNET_LINE_ENDING)[:-1]:
+                self.__capture.request(self.__capture_session, request)
+
+    def __captureResponse(self, line):
+        if self.__capture is not None:
+            self.__capture.response(self.__capture_session, line.decode("ascii"))
+
+    def __waitReadable(self, timeout):
+        """Blocks until the socket has data to be read or timeout seconds have passed.
+        returns True if the socket is readable"""
+        return len(self.__selector.select(timeout)) > 0
 
     def __receive(self, wait_time = MAX_SECONDS_WAIT_FOR_RECEIVE):
+        """Returns the next line (bytes, without TELNET_LINE_ENDING) sent by the NETIO230A.
+        Raises NameError if no complete line arrived within wait_time seconds."""
         assert self.__s
         sock = self.__s
-        start = time.time()
-        while sock not in select.select([sock], [sock], [sock])[0]:
-            time.sleep(wait_time/TIMES_WAIT_FOR_RECEIVE)
-            if time.time() - start > wait_time:
+        deadline = time.monotonic() + wait_time
+        line = self.__lines.readline()
+        while line is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self.__waitReadable(remaining):
                 raise NameError("The NETIO230A did not answer in time (%.3f s)." % wait_time)
-        response = sock.recv(self.__bufsize)
-        if len(response)==0:
-            self.__shutdownSocket()
-            raise NameError("The NETIO230A is closing the connection unexpectedly")
-        self.log(response, False)
-        return response
+            if self.__lines.receive(sock) == 0:
+                self.__shutdownSocket()
+                raise NameError("The NETIO230A is closing the connection unexpectedly")
+            line = self.__lines.readline()
+        self.log(line)
+        self.__captureResponse(line)
+        return line
     ###   end of class netio230a   ----------------
 
 
 class PowerSocket(object):
-    """ This is a class to represent the power sockets of the NETIO-230A. """
+    """ This is a (mutable) class to represent the power sockets of the NETIO-230A.
+    It is kept for compatibility, the state is returned as OutletState objects by now. """
 
     def __init__(self):
         self.__name = ""
@@ -546,6 +624,14 @@ class PowerSocket(object):
         self.__watchdogOn = False
         self.__interruptDelay = 2
 
+    def update(self,outlet):
+        """ takes over the state of an OutletState """
+        self.__name = outlet.name
+        self.__manualMode = outlet.manual_mode
+        self.__powerOn = outlet.power_on
+        self.__powerOnAfterPowerLoss = outlet.power_on_after_power_loss
+        self.__interruptDelay = outlet.interrupt_delay
+
     def setManualMode(self,manualMode=True):
         self.__manualMode = manualMode
     def getManualMode(self):
@@ -590,10 +676,18 @@ import socket
 import threading
 import array
 import time
-import sys
+import errno
+import ipaddress
+from collections import OrderedDict, namedtuple
 
 NETIO230A_UDP_DISCOVER_PORT = 4000
-DETECTION_TIMEOUT=0.2 # should be enough. Usualy we get the answer in 4.6 ms
+DETECTION_TIMEOUT=0.2 # default time to wait for answers. Usualy we get the answer in 4.6 ms
+# for the unicast sweep of whole networks (see sweep_netio230a_devices()):
+SWEEP_RATE = 20000 # probes per second
+SWEEP_MAX_IN_FLIGHT = 8192 # probes sent but neither answered nor timed out yet (at most SWEEP_RATE*SWEEP_PROBE_TIMEOUT are needed)
+SWEEP_PROBE_TIMEOUT = 0.25 # the time we wait for the answer to a single probe [in seconds]
+SWEEP_MAX_BURST = 0.01 # at most this many seconds worth of probes are sent at once
+SWEEP_RECEIVE_BUFFER = 1024*1024
 DEVICE_NAME_TERMINATION = b"\x00\x30\x30\x38\x30"
 # the request to ask for available NETIO-230A on the network (bytes sniffed using wireshark)
 DISCOVER_REQUEST = b"PCEdit\x02\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x02\x00\x00\x00" + \
@@ -601,90 +695,216 @@ DISCOVER_REQUEST = b"PCEdit\x02\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\
                    b"\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00"
 
 
-# thread to run the UDP server that listens to answering NETIOs on your network
-class UDPintsockThread(threading.Thread):
-    def __init__ (self,port,callback_for_found_devices):
-        """ listens to answers from available NETIO-230A devices on the LAN and calls
-            callback_for_found_devices([deviceName, ip, sm, gw, mac, answerTime])     """
-        threading.Thread.__init__(self)
-        self.__port = port
-        self.__callback = callback_for_found_devices
-        self.__startTime = time.time()
-    def run(self):
-        addr = ('', self.__port)
-        # Create socket and bind to address
-        UDPinsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        UDPinsock.bind(addr)
-        # will listen for three seconds to your network
-        UDPinsock.settimeout(DETECTION_TIMEOUT)
-        while True:
-            try:
-                # Receive messages
-                data, addr = UDPinsock.recvfrom(1024)
-                # keep timestamp of arriving package
-                answerTime=time.time()
-            except:
-                #print "server timeout"
-                break
-            # check if we found a NETIO-230A
-            if data.find(b"IPCam") == 0 and len(data)== 61:
-                # documentation of data is found on http://wiki.github.com/pklaus/netio230a/netdiscover-protocol
-                deviceName = data[38:data.find(DEVICE_NAME_TERMINATION)].decode('ascii')
-                data = array.array('B', data)
-                ip = []
-                for n in range(0, 4):
-                    ip.append(data[10+n])
-                mac = [0,0,0,0,0,0]
-                for n in range(0, 6):
-                    mac[n] = data[14+n]
-                sm = []
-                for n in range(0, 4):
-                    sm.append(data[20+n])
-                gw = []
-                for n in range(0, 4):
-                    gw.append(data[27+n])
-                device = [deviceName, ip, sm, gw, mac, (answerTime-self.__startTime)*1000]
-                self.__callback(device)
-        UDPinsock.close()
-
-
-def discover_netio230a_devices(callback_for_found_devices):
-    dest = ('<broadcast>',NETIO230A_UDP_DISCOVER_PORT)
-    #dest = ('255.255.255.255',NETIO230A_UDP_DISCOVER_PORT)
-    myUDPintsockThread = UDPintsockThread(NETIO230A_UDP_DISCOVER_PORT,callback_for_found_devices)
-    myUDPintsockThread.start()
+# The answer of a NETIO-230A to DISCOVER_REQUEST (61 bytes), documented on
+# http://wiki.github.com/pklaus/netio230a/netdiscover-protocol :
+# "IPCam", 5 bytes, IP address (4), MAC address (6), subnet mask (4), 3 bytes, gateway (4), 7 bytes, name (23)
+DISCOVERY_REPLY = struct.Struct("!5s5x4B6B4B3x4B7x23s")
+DISCOVERY_REPLY_MAGIC = b"IPCam"
+
+# ip, netmask, gateway and mac are tuples of ints, answer_time is given in ms (or None if unknown)
+DiscoveredDevice = namedtuple('DiscoveredDevice', ['name', 'ip', 'netmask', 'gateway', 'mac', 'answer_time'])
+
 
+def decode_discovery_reply(data, answerTime):
+    """ returns a DiscoveredDevice for the answer of a NETIO-230A (bytes, bytearray or memoryview)
+        or None if data is not such an answer """
+    # check if we found a NETIO-230A
+    if len(data) != DISCOVERY_REPLY.size:
+        return None
+    fields = DISCOVERY_REPLY.unpack_from(data)
+    if fields[0] != DISCOVERY_REPLY_MAGIC:
+        return None
+    # the name is terminated by DEVICE_NAME_TERMINATION (which starts with a null byte)
+    name = fields[19].split(b"\x00", 1)[0].decode('ascii')
+    return DiscoveredDevice(name, fields[1:5], fields[11:15], fields[15:19], fields[5:11], answerTime)
+
+def encode_discovery_reply(name, ip, netmask, gateway, mac):
+    """ returns the answer a NETIO-230A sends to DISCOVER_REQUEST (e.g. to simulate devices) """
+    name = name.encode('ascii') + DEVICE_NAME_TERMINATION
+    return DISCOVERY_REPLY.pack(DISCOVERY_REPLY_MAGIC, *(tuple(ip) + tuple(mac) + tuple(netmask) + tuple(gateway) + (name,)))
+
+
+def _open_discovery_sockets():
+    """ returns the UDP sockets used for a discovery: (listeners, senders) where listeners contains
+        the socket bound to the discovery port (the devices broadcast their answer to it) if
+        the port is available and senders one socket per interface to send the request from """
+    listeners = []
+    senders = []
+    listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        listener.bind(('', NETIO230A_UDP_DISCOVER_PORT))
+        listeners.append(listener)
+    except socket.error:
+        # the port is in use: we still get the answers sent directly to the sending sockets
+        listener.close()
     # send on all interfaces of the computer:
     # cf. last lines of the comment <http://serverfault.com/questions/72112/how-to-fix-the-global-broadcast-address-255-255-255-255-behavior-on-windows/72152#72152>
-    interfaces = all_interfaces()
+    try:
+        interfaces = all_interfaces()
+    except Exception:
+        interfaces = []
     # but in case we could not enumerate all interfaces we still want one try:
     if len(interfaces) == 0: interfaces = [['','']]
     for interface in interfaces:
         iface = "" if interface[1]=="" else socket.inet_ntoa(interface[1])
+        UDPoutsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
-            UDPoutsock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             # to allow broadcast communication:
             UDPoutsock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
             UDPoutsock.bind((iface, 0))
-            # send UDP broadcast:
-            UDPoutsock.sendto(DISCOVER_REQUEST, dest)
-            print("Trying on interface '{}'".format(iface))
-        except:
-            print("Could not check on interface '{}'".format(iface))
-    myUDPintsockThread.join()
+        except socket.error:
+            UDPoutsock.close()
+            continue
+        UDPoutsock.setblocking(False)
+        senders.append(UDPoutsock)
+    return listeners, senders
+
+
+def iter_netio230a_devices(timeout=DETECTION_TIMEOUT, expected=None):
+    """ Generator yielding a DiscoveredDevice for every NETIO-230A answering the discovery request as soon as its answer arrives.
+
+        The request is broadcast on all interfaces at once and the answers are collected from
+        all sockets by a single selector loop. The discovery stops after timeout seconds or as
+        soon as `expected` devices answered. """
+    listeners, senders = _open_discovery_sockets()
+    sockets = listeners + senders
+    selector = selectors.DefaultSelector()
+    for sock in sockets:
+        selector.register(sock, selectors.EVENT_READ)
+    startTime = time.time()
+    deadline = time.monotonic() + timeout
+    found = set()
+    buffer = bytearray(1024)
+    view = memoryview(buffer)
+    try:
+        for sock in senders:
+            try:
+                # send UDP broadcast:
+                sock.sendto(DISCOVER_REQUEST, ('<broadcast>', NETIO230A_UDP_DISCOVER_PORT))
+            except socket.error:
+                pass
+        while expected is None or len(found) < expected:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            readable = [key.fileobj for key, events in selector.select(remaining)]
+            for sock in readable:
+                try:
+                    size, addr = sock.recvfrom_into(buffer)
+                except socket.error:
+                    continue
+                device = decode_discovery_reply(view[:size], (time.time()-startTime)*1000)
+                # the same answer may arrive on several sockets:
+                if device is None or device.mac in found:
+                    continue
+                found.add(device.mac)
+                yield device
+    finally:
+        selector.close()
+        for sock in sockets:
+            sock.close()
+
+
+def sweep_netio230a_devices(networks, rate=SWEEP_RATE, max_in_flight=SWEEP_MAX_IN_FLIGHT, probe_timeout=SWEEP_PROBE_TIMEOUT, expected=None, port=NETIO230A_UDP_DISCOVER_PORT):
+    """ Generator yielding a DiscoveredDevice for every NETIO-230A in networks (a list of CIDR strings like "10.1.0.0/16").
+
+        Instead of a broadcast (which doesn't pass routers) DISCOVER_REQUEST is sent by unicast
+        to every host address of the networks. All probes go out through a single socket at
+        no more than rate probes per second with at most max_in_flight of them waiting for
+        an answer (for up to probe_timeout seconds) at any time. """
+    if isinstance(networks, str):
+        networks = [networks]
+    targets = (str(host) for network in networks for host in ipaddress.ip_network(network, strict=False).hosts())
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SWEEP_RECEIVE_BUFFER)
+    except socket.error:
+        pass
+    try:
+        # like the broadcast discovery we use the discovery port as source port
+        sock.bind(('', NETIO230A_UDP_DISCOVER_PORT))
+    except socket.error:
+        sock.bind(('', 0))
+    sock.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(sock, selectors.EVENT_READ)
+    # address -> time the probe was sent (in the order they were sent, so the oldest comes first):
+    pending = OrderedDict()
+    found = set()
+    interval = 1.0 / rate
+    next_send = time.monotonic()
+    target = next(targets, None)
+    buffer = bytearray(1024)
+    view = memoryview(buffer)
+    try:
+        while expected is None or len(found) < expected:
+            now = time.monotonic()
+            while pending and next(iter(pending.values())) + probe_timeout <= now:
+                pending.popitem(last=False)
+            while target is not None and len(pending) < max_in_flight and next_send <= now:
+                try:
+                    sock.sendto(DISCOVER_REQUEST, (target, port))
+                except socket.error as error:
+                    if error.errno in (errno.EAGAIN, errno.EWOULDBLOCK, errno.ENOBUFS):
+                        # the send buffer is full: try again with the same target a bit later
+                        next_send = now + interval
+                        break
+                    # e.g. no route to this host: skip it
+                else:
+                    pending[target] = now
+                target = next(targets, None)
+                # we may catch up with the rate by sending a short burst but not more:
+                next_send = max(next_send, now - SWEEP_MAX_BURST) + interval
+            if target is None and not pending:
+                break
+            if target is not None and len(pending) < max_in_flight:
+                wait = next_send - now
+            else:
+                wait = next(iter(pending.values())) + probe_timeout - now
+            wait = max(wait, 0)
+            readable = len(selector.select(wait)) > 0
+            while readable:
+                try:
+                    size, addr = sock.recvfrom_into(buffer)
+                except socket.error:
+                    break
+                answerTime = time.monotonic()
+                sent = pending.pop(addr[0], None)
+                device = decode_discovery_reply(view[:size], (answerTime - sent)*1000 if sent is not None else None)
+                if device is None or device.mac in found:
+                    continue
+                found.add(device.mac)
+                yield device
+                if expected is not None and len(found) >= expected:
+                    break
+    finally:
+        selector.close()
+        sock.close()
+
+
+def discover_netio230a_devices(callback_for_found_devices, timeout=DETECTION_TIMEOUT, expected=None):
+    """ calls callback_for_found_devices(device) with a DiscoveredDevice for every
+        NETIO-230A found on the LAN (see iter_netio230a_devices()) """
+    for device in iter_netio230a_devices(timeout, expected):
+        callback_for_found_devices(device)
 
 ## http://code.activestate.com/recipes/439093/#c1
 try:
     import fcntl
 except:
     pass
-import struct
 import array
 def all_interfaces():
+    """ returns a list of (name, ip) of the IPv4 interfaces (ip as 4 bytes) using the SIOCGIFCONF ioctl
+        or an empty list where it is not available """
     max_possible = 128  # arbitrary. raise if needed.
-    num_bytes = max_possible * 32
-    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # the size of struct ifreq differs between 32 and 64 bit systems:
+    ifreq_size = 40 if struct.calcsize('P') == 8 else 32
+    num_bytes = max_possible * ifreq_size
     names = array.array('B', b'\0' * num_bytes)
+    s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     try:
         outbytes = struct.unpack('iL', fcntl.ioctl(
             s.fileno(),
@@ -693,22 +913,17 @@ def all_interfaces():
         ))[0]
     except:
         return []
-    namestr = names.tostring()
+    finally:
+        s.close()
+    # array.tostring() was removed in Python 3.9:
+    namestr = names.tobytes() if hasattr(names, 'tobytes') else names.tostring()
     lst = []
-    for i in range(0, outbytes, 40):
+    for i in range(0, outbytes, ifreq_size):
         name = namestr[i:i+16].split(b'\0', 1)[0]
         ip   = namestr[i+20:i+24]
         lst.append((name, ip))
     return lst
 
-all_devices=[]
-def device_detected_callback(device):
-    global all_devices
-    all_devices.append(device)
-
 # if any software module wants to get all found devices with one call (blocking) then this function can be used:
-def get_all_detected_devices():
-    global all_devices
-    all_devices = []
-    discover_netio230a_devices(device_detected_callback)
-    return all_devices
+def get_all_detected_devices(timeout=DETECTION_TIMEOUT, expected=None):
+    return list(iter_netio230a_devices(timeout, expected))
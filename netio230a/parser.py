@@ -0,0 +1,97 @@
+#
+# -*- encoding: UTF8 -*-
+
+
+#   This file is part of netio230a.
+#
+#   netio230a is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   netio230a is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with netio230a.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Parsers for the responses of the NETIO-230A.
+
+They work on the bytes received from the device (the content of a response without
+the "250 " prefix) so that nothing needs to be decoded before it is matched. All
+patterns are compiled once when the module is loaded.
+"""
+
+import re
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+PortSetup = namedtuple('PortSetup', ['name', 'manual_mode', 'interrupt_delay', 'power_on_after_power_loss'])
+NetworkSettings = namedtuple('NetworkSettings', ['dhcp', 'ip', 'netmask', 'gateway'])
+SntpSettings = namedtuple('SntpSettings', ['enabled', 'server'])
+WatchdogSettings = namedtuple('WatchdogSettings', ['enabled', 'ip', 'timeout', 'power_on_delay', 'ping_interval', 'max_retry', 'retry_power_off', 'send_email'])
+
+# 'port list'  ->  1010
+PORT_LIST_PATTERN = re.compile(rb'[01]{4}')
+# 'port setup 1'  ->  "outlet x" manual 5 0   (the name is only quoted if it contains spaces)
+PORT_SETUP_PATTERN = re.compile(rb'(?:"([^"]*)"|(\S+))\s+(manual|timer)\s+(\d+)\s+([01])')
+# 'system time'  ->  2010/06/21,19:56:19
+SYSTEM_TIME_PATTERN = re.compile(rb'(\d{4})/(\d{1,2})/(\d{1,2}),(\d{1,2}):(\d{1,2}):(\d{1,2})')
+# 'uptime'  ->  0 years 5 days 3 hours 25 min 12 sec
+UPTIME_PATTERN = re.compile(rb'(\d+) years (\d+) days (\d+) hours (\d+) min (\d+) sec')
+# 'system eth'  ->  manual 192.168.1.2 255.255.255.0 192.168.1.1
+NETWORK_SETTINGS_PATTERN = re.compile(rb'(dhcp|manual)\s+(\S+)\s+(\S+)\s+(\S+)')
+# 'system sntp'  ->  enable time.nist.gov
+SNTP_SETTINGS_PATTERN = re.compile(rb'(enable|disable)\s+(\S+)')
+# 'port wd 1'  ->  enable 192.168.1.1 10 30 10 3 enable disable
+# (enable, ip, timeout, power on delay, ping interval, max. retry, switch off after max. retry, send email)
+WATCHDOG_SETTINGS_PATTERN = re.compile(rb'(enable|disable)\s+(\S+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(\d+)\s+(enable|disable|1|0)\s+(enable|disable|1|0)')
+
+_ON = (b"enable", b"1")
+_ONE = ord("1")
+
+
+def _match(pattern, response, what):
+    match = pattern.fullmatch(response)
+    if match is None:
+        raise NameError("Unexpected response to '%s' from the NETIO-230A: %r" % (what, bytes(response)))
+    return match
+
+def parsePortList(response):
+    """ returns a list of four booleans specifying which power sockets are switched on """
+    _match(PORT_LIST_PATTERN, response, "port list")
+    return [status == _ONE for status in response]
+
+def parsePortSetup(response):
+    """ returns a PortSetup (the interrupt delay is given in seconds) """
+    quoted, plain, mode, delay, power_on = _match(PORT_SETUP_PATTERN, response, "port setup").groups()
+    name = quoted if plain is None else plain
+    return PortSetup(name.decode("ascii"), mode == b"manual", int(delay), power_on == b"1")
+
+def parseSystemTime(response):
+    """ returns a datetime object """
+    return datetime(*[int(field) for field in _match(SYSTEM_TIME_PATTERN, response, "system time").groups()])
+
+def parseUptime(response):
+    """ returns a timedelta object """
+    years, days, hours, minutes, seconds = [int(field) for field in _match(UPTIME_PATTERN, response, "uptime").groups()]
+    return timedelta(days=years*365+days, hours=hours, minutes=minutes, seconds=seconds)
+
+def parseNetworkSettings(response):
+    """ returns a NetworkSettings """
+    mode, ip, netmask, gateway = _match(NETWORK_SETTINGS_PATTERN, response, "system eth").groups()
+    return NetworkSettings(mode == b"dhcp", ip.decode("ascii"), netmask.decode("ascii"), gateway.decode("ascii"))
+
+def parseSntpSettings(response):
+    """ returns a SntpSettings """
+    enabled, server = _match(SNTP_SETTINGS_PATTERN, response, "system sntp").groups()
+    return SntpSettings(enabled in _ON, server.decode("ascii"))
+
+def parseWatchdogSettings(response):
+    """ returns a WatchdogSettings (the times are given in seconds) """
+    enabled, ip, timeout, power_on_delay, ping_interval, max_retry, retry_power_off, send_email = _match(WATCHDOG_SETTINGS_PATTERN, response, "port wd").groups()
+    return WatchdogSettings(enabled in _ON, ip.decode("ascii"), int(timeout), int(power_on_delay), int(ping_interval), int(max_retry), retry_power_off in _ON, send_email in _ON)
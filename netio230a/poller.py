@@ -0,0 +1,261 @@
+#
+# -*- encoding: UTF8 -*-
+
+
+#   This file is part of netio230a.
+#
+#   netio230a is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   netio230a is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with netio230a.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Watch the outlets of many devices and get notified when one of them is switched.
+
+The Poller polls `port list` on every device of a Fleet and keeps the last known
+state of each device as a 4 bit integer (bit 0 is outlet 1). A device is polled
+more often after a change and less often while nothing happens. Only the
+transitions are passed on, to callbacks or to async iterators:
+
+    async with Fleet.fromConfiguration() as fleet, Poller(fleet) as poller:
+        poller.subscribe(lambda transition: print(transition))
+        async for transition in poller.transitions():
+            print(transition.device.name, transition.outlet, transition.state)
+"""
+
+import asyncio
+import heapq
+import inspect
+import time
+from collections import namedtuple
+
+# the poll interval of a device right after a change [in seconds]:
+MIN_POLL_INTERVAL = 1.0
+# the poll interval of a device that has been quiet for long:
+MAX_POLL_INTERVAL = 30.0
+# the factor the poll interval grows by after every poll without a change:
+POLL_BACKOFF = 1.5
+# the state of a device that hasn't answered yet:
+UNKNOWN = -1
+
+# outlet is one based, state tells whether it is switched on now,
+# time is the time.time() of the poll that noticed the transition
+Transition = namedtuple('Transition', ['device', 'outlet', 'state', 'time'])
+
+
+def stateBits(power_sockets):
+    """ the list of four boolean power states as a 4 bit integer (bit 0 is outlet 1) """
+    bits = 0
+    for number, power in enumerate(power_sockets):
+        if power:
+            bits |= 1 << number
+    return bits
+
+def bitsState(bits):
+    """ the 4 bit integer as a list of four boolean power states """
+    return [bool(bits & (1 << number)) for number in range(4)]
+
+def transitions(device, previous, current, when):
+    """ returns the list of Transition from the state previous to the state current (both 4 bit integers) """
+    if previous == UNKNOWN or previous == current:
+        return []
+    changed = previous ^ current
+    return [Transition(device, number+1, bool(current & (1 << number)), when) for number in range(4) if changed & (1 << number)]
+
+
+class TransitionStream(object):
+    """ An async iterator over the transitions seen by a Poller (see Poller.transitions()).
+    The iteration ends when the stream is closed or the poller stops. """
+
+    def __init__(self, poller, devices=None):
+        self.__poller = poller
+        self.__devices = None if devices is None else set(devices)
+        self.__queue = asyncio.Queue()
+        self.__closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.__closed and self.__queue.empty():
+            raise StopAsyncIteration
+        transition = await self.__queue.get()
+        if transition is None:
+            raise StopAsyncIteration
+        return transition
+
+    def put(self, transition):
+        if self.__devices is None or transition.device in self.__devices:
+            self.__queue.put_nowait(transition)
+
+    def close(self):
+        """ ends the iteration (after the transitions already queued) """
+        if not self.__closed:
+            self.__closed = True
+            self.__poller.unsubscribe(self.put)
+            self.__queue.put_nowait(None)
+
+
+class Poller(object):
+    """ Polls the power status of the devices of a Fleet (or of the given ones) with an adaptive interval.
+    After a change a device is polled every min_interval seconds, every poll without a change
+    makes its interval backoff times longer (up to max_interval). Devices not answering keep
+    their last known state (the errors are kept in errors until the device answers again),
+    the exceptions of failing subscribers are kept in callback_errors. """
+
+    def __init__(self, fleet, min_interval=MIN_POLL_INTERVAL, max_interval=MAX_POLL_INTERVAL, backoff=POLL_BACKOFF, devices=None):
+        self.fleet = fleet
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.devices = list(fleet.devices if devices is None else devices)
+        # per device (in the order of the devices):
+        self.__index = dict([(device, number) for number, device in enumerate(self.devices)])
+        self.__bits = [UNKNOWN] * len(self.devices)
+        self.__intervals = [min_interval] * len(self.devices)
+        self.errors = {}
+        # the last exception raised by each subscribed callback:
+        self.callback_errors = {}
+        self.__callbacks = []
+        self.__streams = []
+        # (when, device number) of the devices waiting for their next poll:
+        self.__schedule = []
+        self.__wakeup = None
+        self.__semaphore = None
+        self.__task = None
+        self.__polls = set()
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    def state(self, device):
+        """ returns the last known power status of the device as a list of four boolean values (None if unknown) """
+        bits = self.__bits[self.__index[device]]
+        return None if bits == UNKNOWN else bitsState(bits)
+
+    def interval(self, device):
+        """ returns the current poll interval of the device in seconds """
+        return self.__intervals[self.__index[device]]
+
+    def subscribe(self, callback):
+        """ callback(transition) is called for every transition (it may be a coroutine function) """
+        self.__callbacks.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self.__callbacks:
+            self.__callbacks.remove(callback)
+
+    def transitions(self, devices=None):
+        """ returns a TransitionStream of the transitions of all devices (or of the given ones) from now on """
+        stream = TransitionStream(self, devices)
+        self.__streams.append(stream)
+        self.subscribe(stream.put)
+        return stream
+
+    async def poll(self, devices=None):
+        """ polls all devices (or the given ones) once, notifies the subscribers and returns the list of Transition """
+        devices = self.devices if devices is None else devices
+        results = await self.fleet.run("getPowerSocketList", devices=devices)
+        now = time.time()
+        found = []
+        for result in results:
+            found += self.__update(result.device, result.value, result.error, now)
+        for transition in found:
+            await self.__notify(transition)
+        return found
+
+    def __update(self, device, power_sockets, error, now):
+        """ keeps the result of a poll and returns the list of Transition """
+        number = self.__index[device]
+        if error is not None:
+            self.errors[device] = error
+            self.__intervals[number] = min(self.__intervals[number] * self.backoff, self.max_interval)
+            return []
+        self.errors.pop(device, None)
+        bits = stateBits(power_sockets)
+        changes = transitions(device, self.__bits[number], bits, now)
+        self.__bits[number] = bits
+        if changes:
+            self.__intervals[number] = self.min_interval
+        else:
+            self.__intervals[number] = min(self.__intervals[number] * self.backoff, self.max_interval)
+        return changes
+
+    async def __notify(self, transition):
+        for callback in list(self.__callbacks):
+            # a failing subscriber must not keep the transition from the others:
+            try:
+                result = callback(transition)
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as error:
+                self.callback_errors[callback] = error
+
+    def start(self):
+        """ starts polling in the background (in the running event loop) """
+        if self.__task is None:
+            now = time.monotonic()
+            self.__schedule = [(now, number) for number in range(len(self.devices))]
+            heapq.heapify(self.__schedule)
+            self.__wakeup = asyncio.Event()
+            # like Fleet.run() at most fleet.concurrency devices are polled at a time:
+            self.__semaphore = asyncio.Semaphore(self.fleet.concurrency)
+            self.__task = asyncio.ensure_future(self.__run())
+
+    async def stop(self):
+        """ stops polling and ends the iteration of all transition streams """
+        task, self.__task = self.__task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, *self.__polls, return_exceptions=True)
+        for stream in self.__streams:
+            stream.close()
+        self.__streams = []
+
+    async def __run(self):
+        try:
+            while True:
+                now = time.monotonic()
+                while self.__schedule and self.__schedule[0][0] <= now:
+                    # every device is scheduled again as soon as it has answered (a device
+                    # not answering doesn't hold up the polls of the others):
+                    poll = asyncio.ensure_future(self.__pollDevice(heapq.heappop(self.__schedule)[1]))
+                    self.__polls.add(poll)
+                    poll.add_done_callback(self.__polls.discard)
+                self.__wakeup.clear()
+                timeout = self.__schedule[0][0] - time.monotonic() if self.__schedule else None
+                try:
+                    await asyncio.wait_for(self.__wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            for poll in list(self.__polls):
+                poll.cancel()
+
+    async def __pollDevice(self, number):
+        device = self.devices[number]
+        try:
+            async with self.__semaphore:
+                try:
+                    power_sockets = await asyncio.wait_for(self.fleet.client(device).getPowerSocketList(), self.fleet.timeout)
+                    error = None
+                except Exception as exception:
+                    power_sockets, error = None, exception
+            for transition in self.__update(device, power_sockets, error, time.time()):
+                await self.__notify(transition)
+        finally:
+            heapq.heappush(self.__schedule, (time.monotonic() + self.__intervals[number], number))
+            self.__wakeup.set()
@@ -0,0 +1,192 @@
+#
+# -*- encoding: UTF8 -*-
+
+
+#   This file is part of netio230a.
+#
+#   netio230a is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   netio230a is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with netio230a.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+A process-wide pool of logged-in netio230a sessions.
+
+The NETIO-230A accepts a single KSHELL session only. The pool therefore keeps one
+session per (host, port, username), hands it to one caller at a time (in the order
+they asked for it, a caller with another password logs in again), keeps it alive while it is idle and closes it when it wasn't
+used for a long time:
+
+    with netio230a.pool.session("192.168.1.2", "admin", "secret", 1234) as netio:
+        netio.setPowerSocketPower(1, True)
+"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from .netio230a import netio230a
+
+# send a keep-alive request when a session was idle for so long [in seconds]
+# (the device closes idle connections with a 130 CONNECTION TIMEOUT):
+SESSION_KEEPALIVE_INTERVAL = 30.
+# close sessions that nobody used for so long [in seconds]:
+SESSION_IDLE_TIMEOUT = 300.
+# how often the maintenance thread looks after the idle sessions [in seconds]:
+POOL_MAINTENANCE_INTERVAL = 1.
+
+
+class _PooledSession(object):
+    """ one device of the pool with its FIFO of callers waiting for it """
+
+    def __init__(self, host, port, username):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.netio = None
+        # the password the session is logged in with:
+        self.password = None
+        self.busy = False
+        self.waiters = deque()
+        self.last_used = time.monotonic()
+        self.last_traffic = self.last_used
+
+
+class SessionPool(object):
+
+    def __init__(self, secureLogin=False, keepalive_interval=SESSION_KEEPALIVE_INTERVAL, idle_timeout=SESSION_IDLE_TIMEOUT):
+        self.secureLogin = secureLogin
+        self.keepalive_interval = keepalive_interval
+        self.idle_timeout = idle_timeout
+        self.__lock = threading.Lock()
+        self.__sessions = {}
+        self.__maintenance_thread = None
+
+    @contextmanager
+    def session(self, host, username, password, port=23, timeout=None):
+        """Context manager handing out the logged-in netio230a session for the device.
+        Concurrent callers are served one after the other in the order they arrived.
+        Raises NameError if the session didn't become available within timeout seconds."""
+        entry = self.__acquire((host, port, username), timeout)
+        try:
+            if entry.netio is not None and entry.password != password:
+                # nobody gets a session without the password it was logged in with:
+                netio, entry.netio = entry.netio, None
+                try:
+                    netio.disconnect()
+                except Exception:
+                    pass
+            if entry.netio is None:
+                entry.netio = netio230a(host, username, password, self.secureLogin, port)
+                entry.password = password
+                self.__startMaintenance()
+            yield entry.netio
+        finally:
+            entry.last_used = entry.last_traffic = time.monotonic()
+            self.__release(entry)
+
+    def close(self):
+        """logs out of all sessions that are not in use right now"""
+        with self.__lock:
+            entries = [entry for entry in self.__sessions.values() if not entry.busy]
+            for entry in entries:
+                entry.busy = True
+        for entry in entries:
+            self.__closeSession(entry)
+
+    def __len__(self):
+        return len(self.__sessions)
+
+    def __acquire(self, key, timeout):
+        with self.__lock:
+            entry = self.__sessions.get(key)
+            if entry is None:
+                entry = _PooledSession(*key)
+                self.__sessions[key] = entry
+            if not entry.busy and len(entry.waiters) == 0:
+                entry.busy = True
+                return entry
+            turn = threading.Event()
+            entry.waiters.append(turn)
+        if turn.wait(timeout):
+            return entry
+        with self.__lock:
+            if turn in entry.waiters:
+                entry.waiters.remove(turn)
+                raise NameError("Timeout while waiting for the session to %s (it is in use by someone else)." % key[0])
+        # the session was handed to us right after the timeout:
+        return entry
+
+    def __release(self, entry):
+        with self.__lock:
+            if len(entry.waiters) > 0:
+                # hand the session directly to the next caller in line:
+                entry.waiters.popleft().set()
+                return
+            entry.busy = False
+            # forget about devices we're not logged in to (closed or the login failed):
+            key = (entry.host, entry.port, entry.username)
+            if entry.netio is None and self.__sessions.get(key) is entry:
+                del self.__sessions[key]
+
+    def __closeSession(self, entry):
+        try:
+            if entry.netio is not None:
+                entry.netio.disconnect()
+        except Exception:
+            pass
+        entry.netio = None
+        self.__release(entry)
+
+    def __startMaintenance(self):
+        with self.__lock:
+            if self.__maintenance_thread is not None:
+                return
+            self.__maintenance_thread = threading.Thread(target=self.__maintain)
+            # When the rest of the program terminates, the thread should stop as well:
+            self.__maintenance_thread.daemon = True
+            self.__maintenance_thread.start()
+
+    def __maintain(self):
+        """ sends keep-alive requests on idle sessions and closes the ones idle for too long """
+        while True:
+            time.sleep(POOL_MAINTENANCE_INTERVAL)
+            with self.__lock:
+                if len(self.__sessions) == 0:
+                    self.__maintenance_thread = None
+                    return
+                # we only look after the sessions nobody is using right now:
+                idle = [entry for entry in self.__sessions.values() if not entry.busy and entry.netio is not None]
+                for entry in idle:
+                    entry.busy = True
+            now = time.monotonic()
+            for entry in idle:
+                if now - entry.last_used > self.idle_timeout:
+                    self.__closeSession(entry)
+                    continue
+                if now - entry.last_traffic > self.keepalive_interval:
+                    try:
+                        entry.netio.keepAlive()
+                    except Exception:
+                        # the next user of the session will reconnect:
+                        pass
+                    entry.last_traffic = time.monotonic()
+                self.__release(entry)
+
+
+# the pool shared by the whole process:
+default_pool = SessionPool()
+
+def session(host, username, password, port=23, timeout=None):
+    """ returns the context manager handing out the session for the device from the default_pool """
+    return default_pool.session(host, username, password, port, timeout)
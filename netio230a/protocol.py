@@ -0,0 +1,257 @@
+#
+# -*- encoding: UTF8 -*-
+
+
+#   This file is part of netio230a.
+#
+#   netio230a is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   netio230a is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with netio230a.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Building blocks of the KSHELL protocol spoken by the NETIO-230A that don't do any I/O themselves.
+"""
+
+# for the login with a hashed password:
+import hashlib
+import re
+import socket
+# for errno codes (cf. <http://docs.python.org/library/errno.html>)
+import errno
+import math
+
+from .state import OutletState
+from . import parser
+
+KSHELL_LINE_ENDING = b"\r\n"
+# we drop the consumed bytes at the beginning of the buffer only when at least this many accumulated:
+COMPACT_THRESHOLD = 4096
+
+
+class LineBuffer(object):
+    """ Incremental framing of the lines (terminated by line_ending) of one connection.
+
+    Received data is appended to a single bytearray which is reused for the whole
+    lifetime of the connection. readline() hands out exactly one line at a time no
+    matter how the lines were split or coalesced into TCP segments by the network. """
+
+    def __init__(self, chunk_size=1024, line_ending=KSHELL_LINE_ENDING):
+        self.__line_ending = line_ending
+        self.__buffer = bytearray()
+        # index of the first byte that has not been handed out yet:
+        self.__start = 0
+        # index up to which we already searched for a line ending (to avoid re-scanning):
+        self.__scanned = 0
+        # memory for socket.recv_into() (so that we don't allocate a new bytes object for every recv):
+        self.__chunk = bytearray(chunk_size)
+        self.__chunk_view = memoryview(self.__chunk)
+
+    def __len__(self):
+        """ the number of bytes received but not yet handed out """
+        return len(self.__buffer) - self.__start
+
+    def feed(self, data):
+        """ appends data (bytes, bytearray or memoryview) to the buffer """
+        self.__compact()
+        self.__buffer += data
+
+    def receive(self, sock):
+        """ reads the data available on sock into the buffer.
+        returns the number of bytes read (0 means that the peer closed the connection) """
+        size = sock.recv_into(self.__chunk)
+        if size:
+            self.feed(self.__chunk_view[:size])
+        return size
+
+    def readline(self):
+        """ returns the next complete line (bytes, without the line ending) or None """
+        end = self.__buffer.find(self.__line_ending, self.__scanned)
+        if end == -1:
+            # the line ending might be split in two and its first part already be in the buffer:
+            self.__scanned = max(self.__start, len(self.__buffer) - len(self.__line_ending) + 1)
+            return None
+        line = bytes(self.__buffer[self.__start:end])
+        self.__start = self.__scanned = end + len(self.__line_ending)
+        return line
+
+    def clear(self):
+        del self.__buffer[:]
+        self.__start = self.__scanned = 0
+
+    def __compact(self):
+        if self.__start == 0:
+            return
+        if self.__start == len(self.__buffer) or self.__start >= COMPACT_THRESHOLD:
+            # deleting from the front of a bytearray keeps its allocated storage
+            del self.__buffer[:self.__start]
+            self.__scanned -= self.__start
+            self.__start = 0
+
+
+# The welcome message should be in the form     "100 HELLO E675DDA5"  (or "100 HELLO E675DDA5 - KSHELL V1.2")
+# where the eight hex digits are a random salt used to hash the password:
+HELLO_PATTERN = re.compile(b"^100 HELLO ([0-9A-F]{8})( - KSHELL V1..)?$")
+CONNECTION_TIMEOUT = b"130 CONNECTION TIMEOUT"
+# the requests needed to know the complete state of the power sockets (see KshellProtocol.parseOutletStates()):
+OUTLET_STATE_REQUESTS = ["port list"] + ["port setup " + str(i+1) for i in range(4)]
+
+
+def describeConnectionError(error, host):
+    """ returns a human readable explanation for errors raised while connecting to host
+    or None if the error is not a known one """
+    if isinstance(error, socket.timeout):
+        return "Timeout while connecting to " + host
+    if isinstance(error, socket.gaierror) or isinstance(error, socket.error) and error.errno == errno.ENETUNREACH:
+        return "Unable to understand the host you gave: %s. Please provide a correct IP address or domain name." % host
+    if isinstance(error, socket.error):
+        if error.errno == errno.ECONNREFUSED:
+            return "The connection was refused by the remote host. Possible errors: wrong IP or wrong TCP port given or the telnet server on the NETIO-230A crashed."
+        elif error.errno == errno.EHOSTUNREACH:
+            return "There is no route to the host given: " + host
+        elif error.errno in (errno.ECONNRESET, errno.EPIPE):
+            return "The connection was reset by the device. This is usually the case when you still have another network socket connected to the device. It may also be the case when the telnet server on the device crashed. In this case reboot the device (if possible & sensible)."
+    return None
+
+
+class KshellProtocol(object):
+    """ The client side of a KSHELL session without any I/O.
+
+    Both the blocking netio230a class and the asyncio client feed the data they receive
+    into receiveData() and fetch complete lines with nextLine(). The methods of this
+    class create the requests to send and interpret the responses of the device. """
+
+    def __init__(self, username, password, secureLogin=False):
+        self.__username = username
+        self.__password = password
+        self.__secureLogin = secureLogin
+        self.lines = LineBuffer()
+
+    def reset(self):
+        """ forget about data received on a previous connection """
+        self.lines.clear()
+
+    def receiveData(self, data):
+        self.lines.feed(data)
+
+    def nextLine(self):
+        return self.lines.readline()
+
+    def encodeRequests(self, requests):
+        """ returns the bytes to send for a list of requests """
+        return b"".join([request.encode("ascii") + KSHELL_LINE_ENDING for request in requests])
+
+    def loginRequest(self, hello):
+        """ returns the login command for the welcome message (a line as bytes) of the device """
+        match = HELLO_PATTERN.match(hello)
+        if match is None:
+            raise NameError("Error while connecting: Not received a \"100 HELLO ... signal from the remote device. Maybe not a NET-IO 230A?")
+        if self.__secureLogin:
+            md = hashlib.md5()
+            md.update((self.__username + self.__password).encode("ascii") + match.group(1))
+            return "clogin " + self.__username + " " + md.hexdigest()
+        # use the password in cleartext
+        return "login " + self.__username + " " + self.__password
+
+    def checkLogin(self, line):
+        """ raises a NameError if the response to the login request (a line as bytes) signals a failure """
+        response = line.decode("ascii")
+        if response.startswith("250 "):
+            return
+        if response.startswith("502 "):
+            raise NameError("Error while connecting: Login failed with message 502 UNKNOWN COMMAND. This is usually the case when the telnet server crashed. Reboot the NETIO-230A device to get it up running again.")
+        elif response.startswith("501 "):
+            raise NameError("Error while connecting: Login failed with message 501 INVALID PARAMETER. This is usually the case when the telnet server crashed. Reboot the NETIO-230A device to get it up running again.")
+        elif response.startswith("504 "):
+            raise NameError("You are already logged in. Something strange happened.")
+        raise NameError("Error while connecting: Login failed; " + response)
+
+    def parseResponse(self, request, line, complainIfAnswerNot250=True):
+        """ returns the content of a response (a line as bytes) without the "250 " prefix (still as bytes) """
+        if line.startswith(b"250 "):
+            return line[4:]
+        if complainIfAnswerNot250:
+            raise NameError("Error while sending request: " + request + "\nresponse from NET-IO 230A is:  " + line.decode("ascii", "replace"))
+        return line
+
+    def isConnectionTimeout(self, line):
+        """ the device sends this (unrequested) before closing an idle connection """
+        return line == CONNECTION_TIMEOUT
+
+    ### requests which need some formatting:
+
+    def powerSocketPowerRequest(self, power_socket, switchOn=False):
+        # the type conversion of switchOn ensures that the values are either "0" or "1":
+        return "port " + str(power_socket) + " " + str(int(bool(int(switchOn))))
+
+    def powerSocketListRequest(self, states):
+        """ switches several power sockets with one request (the device waits swdelay between them):
+        states is a list of True (on), False (off) or None (unchanged) for the four power sockets """
+        return "port list " + "".join(["u" if state is None else str(int(bool(state))) for state in states])
+
+    def powerSocketSetupRequest(self, power_socket, name, manualMode, interruptDelay, powerOnAfterPowerLoss):
+        return 'port setup %d "%s" %s %d %d' % (int(power_socket), name, "manual" if manualMode else "timer", interruptDelay, int(bool(powerOnAfterPowerLoss)))
+
+    def switchDelayRequest(self, seconds):
+        return "system swdelay " + str(int(math.ceil(seconds*10.0)))
+
+    def systemTimeRequest(self, dt):
+        return "system time " + dt.strftime("%Y/%m/%d,%H:%M:%S")
+
+    def systemTimezoneRequest(self, hoursOffset):
+        return "system timezone " + str(math.ceil(hoursOffset*3600.0))
+
+    def sntpSettingsRequest(self, enable=True, sntpServer="time.nist.gov"):
+        return "system sntp " + ("enable" if enable else "disable") + " " + sntpServer
+
+    def networkSettingsRequest(self, dhcpMode=False, deviceIP="192.168.1.2", subnetMask="255.255.255.0", gatewayIP="192.168.1.1"):
+        if dhcpMode:
+            return "system eth dhcp"
+        return "system eth manual " + deviceIP + " " + subnetMask + " " + gatewayIP
+
+    ### conversion of the responses (as returned by parseResponse(), see the parser module):
+
+    def parsePowerSocketList(self, response):
+        """ 'port list' returns 4 chars specifying which power sockets are switched on/off """
+        return parser.parsePortList(response)
+
+    def parsePowerSocketSetup(self, response):
+        """ 'port setup N' returns something like   "outlet x" manual 5 0
+        returns a PortSetup (name, manual_mode, interrupt_delay, power_on_after_power_loss) """
+        return parser.parsePortSetup(response)
+
+    def parseOutletStates(self, responses):
+        """ returns a tuple of four OutletState for the responses to the OUTLET_STATE_REQUESTS """
+        powerOnStatus = parser.parsePortList(responses[0])
+        outlets = []
+        for i in range(4):
+            setup = parser.parsePortSetup(responses[i+1])
+            outlets.append(OutletState(i+1, setup.name, powerOnStatus[i], setup.manual_mode, setup.interrupt_delay, setup.power_on_after_power_loss))
+        return tuple(outlets)
+
+    def parseDiscoverable(self, response):
+        return response == b"enable"
+
+    def parseSwitchDelay(self, response):
+        return int(response)/10.0
+
+    def parseSystemTime(self, response):
+        return parser.parseSystemTime(response)
+
+    def parseSystemUptime(self, response):
+        try:
+            return parser.parseUptime(response)
+        except NameError:
+            return False
+
+    def parseSystemTimezone(self, response):
+        return float(int(response))/3600.0
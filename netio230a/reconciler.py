@@ -0,0 +1,225 @@
+#
+# -*- encoding: UTF8 -*-
+
+
+#   This file is part of netio230a.
+#
+#   netio230a is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   netio230a is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with netio230a.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Bring the configuration of many devices to a desired state.
+
+The desired state is a dict with any of these settings:
+
+    {'alias': "rack-7", 'swdelay': 1.5, 'discoverable': False, 'timezone': 1.0,
+     'sntp': {'enabled': True, 'server': "pool.ntp.org"}, 'dns': "10.0.0.2",
+     'outlets': {1: {'name': "router", 'power_on': True, 'manual_mode': True,
+                     'interrupt_delay': 5, 'power_on_after_power_loss': True}}}
+
+(swdelay in seconds, timezone in hours). For every device the reconciler reads the
+current values of the desired settings with a single pipelined round trip and sends
+only the requests changing something (again pipelined):
+
+    async with Fleet.fromConfiguration() as fleet:
+        results = await Reconciler(fleet, desired).run(dry_run=True)
+        print(report(results))
+"""
+
+import math
+import copy
+from collections import namedtuple
+
+from .protocol import KshellProtocol
+from . import parser
+
+# the settings of an outlet given in the desired state (all but power_on are part of 'port setup'):
+OUTLET_SETTINGS = ('name', 'power_on', 'manual_mode', 'interrupt_delay', 'power_on_after_power_loss')
+SETUP_SETTINGS = ('name', 'manual_mode', 'interrupt_delay', 'power_on_after_power_loss')
+NUM_OUTLETS = 4
+
+# setting is e.g. "alias" or "outlet 2 name", request is the request changing the setting
+# (several changes can share a request, like the power status of the outlets)
+Change = namedtuple('Change', ['setting', 'current', 'desired', 'request'])
+# changes is the list of Change, applied tells whether they were sent (not in a dry run),
+# error the exception raised (or None), elapsed the time in seconds
+ReconcileResult = namedtuple('ReconcileResult', ['device', 'changes', 'applied', 'error', 'elapsed'])
+
+# only used to create the requests:
+_protocol = KshellProtocol("", "")
+
+
+def _tenths(seconds):
+    """ the switch delay as the device stores it (in units of 0.1 s) """
+    return int(math.ceil(seconds*10.0))
+
+def _timezoneSeconds(hours):
+    return int(math.ceil(hours*3600.0))
+
+def _same(value):
+    return value
+
+# the system settings: (name, request reading the current value, conversion of the response to a value
+# like the desired one, conversion of a value to what the device stores (for the comparison), request setting a value)
+SYSTEM_SETTINGS = [
+    ('alias', "alias", _same, _same, lambda value: "alias " + value),
+    ('swdelay', "system swdelay", lambda response: int(response)/10.0, _tenths, _protocol.switchDelayRequest),
+    ('discoverable', "system discover", lambda response: response == "enable", bool,
+        lambda value: "system discover " + ("enable" if value else "disable")),
+    ('timezone', "system timezone", lambda response: int(response)/3600.0, _timezoneSeconds, _protocol.systemTimezoneRequest),
+    ('dns', "system dns", _same, _same, lambda value: "system dns " + value),
+]
+SYSTEM_SETTING_NAMES = [setting[0] for setting in SYSTEM_SETTINGS] + ['sntp', 'outlets']
+
+
+def mergeDesiredState(*documents):
+    """ merges the desired states (like the one of a group and the one of a device), later ones take precedence """
+    merged = {}
+    for document in documents:
+        for name, value in (document or {}).items():
+            if name == 'outlets':
+                outlets = merged.setdefault('outlets', {})
+                for number, outlet in value.items():
+                    outlets.setdefault(int(number), {}).update(outlet)
+            elif name == 'sntp':
+                merged.setdefault('sntp', {}).update(value)
+            else:
+                merged[name] = copy.copy(value)
+    return merged
+
+def checkDesiredState(desired):
+    """ raises NameError if the desired state contains unknown settings """
+    unknown = set(desired) - set(SYSTEM_SETTING_NAMES)
+    for number, outlet in desired.get('outlets', {}).items():
+        if not 1 <= int(number) <= NUM_OUTLETS:
+            unknown.add("outlet %s" % number)
+        unknown |= set(["outlet %s %s" % (number, name) for name in set(outlet) - set(OUTLET_SETTINGS)])
+    unknown |= set(["sntp " + name for name in set(desired.get('sntp', {})) - set(['enabled', 'server'])])
+    if unknown:
+        raise NameError("Unknown settings in the desired state: %s" % ", ".join(sorted(unknown)))
+
+def readRequests(desired):
+    """ returns the requests needed to read the current values of the desired settings """
+    requests = [request for name, request, convert, store, change in SYSTEM_SETTINGS if name in desired]
+    if 'sntp' in desired:
+        requests.append("system sntp")
+    outlets = dict([(int(number), outlet) for number, outlet in desired.get('outlets', {}).items()])
+    if any(['power_on' in outlet for outlet in outlets.values()]):
+        requests.append("port list")
+    for number in sorted(outlets):
+        if any([name in outlets[number] for name in SETUP_SETTINGS]):
+            requests.append("port setup %d" % number)
+    return requests
+
+def planChanges(desired, responses):
+    """ returns the list of Change needed to get from the current state (responses is a dict
+    {request: response} of the requests returned by readRequests()) to the desired state """
+    changes = []
+    for name, request, convert, store, change in SYSTEM_SETTINGS:
+        if name in desired:
+            current = convert(responses[request])
+            if store(current) != store(desired[name]):
+                changes.append(Change(name, current, desired[name], change(desired[name])))
+    if 'sntp' in desired:
+        current = parser.parseSntpSettings(responses["system sntp"].encode("ascii"))
+        wanted = current._replace(**desired['sntp'])
+        if wanted != current:
+            changes.append(Change('sntp', current, wanted, _protocol.sntpSettingsRequest(wanted.enabled, wanted.server)))
+    outlets = dict([(int(number), outlet) for number, outlet in desired.get('outlets', {}).items()])
+    if "port list" in responses:
+        power = parser.parsePortList(responses["port list"].encode("ascii"))
+        states = [None] * NUM_OUTLETS
+        power_changes = []
+        for number in sorted(outlets):
+            if 'power_on' in outlets[number] and power[number-1] != bool(outlets[number]['power_on']):
+                states[number-1] = bool(outlets[number]['power_on'])
+                power_changes.append((number, power[number-1], states[number-1]))
+        # all outlets are switched with one request:
+        request = _protocol.powerSocketListRequest(states)
+        changes += [Change("outlet %d power_on" % number, old, new, request) for number, old, new in power_changes]
+    for number in sorted(outlets):
+        if "port setup %d" % number not in responses:
+            continue
+        current = parser.parsePortSetup(responses["port setup %d" % number].encode("ascii"))
+        wanted = current._replace(**dict([(name, outlets[number][name]) for name in SETUP_SETTINGS if name in outlets[number]]))
+        if wanted == current:
+            continue
+        request = _protocol.powerSocketSetupRequest(number, wanted.name, wanted.manual_mode, wanted.interrupt_delay, wanted.power_on_after_power_loss)
+        for name in SETUP_SETTINGS:
+            if getattr(current, name) != getattr(wanted, name):
+                changes.append(Change("outlet %d %s" % (number, name), getattr(current, name), getattr(wanted, name), request))
+    return changes
+
+def changeRequests(changes):
+    """ the requests to send for the changes (each of them once) """
+    requests = []
+    for change in changes:
+        if change.request not in requests:
+            requests.append(change.request)
+    return requests
+
+
+class Reconciler(object):
+    """ Reconciles the devices of a Fleet with their desired state.
+    desired is the desired state of all devices or a function returning the desired state
+    of a FleetDevice (or None to leave the device alone), see mergeDesiredState() for groups. """
+
+    def __init__(self, fleet, desired):
+        self.fleet = fleet
+        self.desired = desired
+        if not callable(desired):
+            checkDesiredState(desired)
+
+    def desiredFor(self, device):
+        if callable(self.desired):
+            desired = self.desired(device)
+            if desired is not None:
+                checkDesiredState(desired)
+            return desired
+        return self.desired
+
+    async def reconcile(self, client, device, dry_run=False):
+        """ returns the changes for one device (sent unless dry_run is True) """
+        desired = self.desiredFor(device)
+        if not desired:
+            return []
+        requests = readRequests(desired)
+        responses = dict(zip(requests, await client.pipeline(requests)))
+        changes = planChanges(desired, responses)
+        if changes and not dry_run:
+            await client.pipeline(changeRequests(changes))
+        return changes
+
+    async def run(self, dry_run=False, devices=None):
+        """ reconciles all devices of the fleet (or the given ones) in parallel
+        returns a list of ReconcileResult (in the order of the devices) """
+        results = await self.fleet.run(self.reconcile, dry_run, devices=devices, with_device=True)
+        return [ReconcileResult(result.device, result.value or [], result.error is None and not dry_run, result.error, result.elapsed)
+                for result in results]
+
+
+def report(results):
+    """ returns a human readable report of the ReconcileResults (like for a dry run) """
+    lines = []
+    for result in results:
+        if result.error is not None:
+            lines.append("%s: error: %s" % (result.device.name, result.error))
+        elif not result.changes:
+            lines.append("%s: up to date" % result.device.name)
+        else:
+            lines.append("%s: %d change%s%s" % (result.device.name, len(result.changes), "" if len(result.changes) == 1 else "s",
+                                               "" if result.applied else " (not applied)"))
+            for change in result.changes:
+                lines.append("    %s: %r -> %r" % (change.setting, change.current, change.desired))
+    return "\n".join(lines)
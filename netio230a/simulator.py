@@ -0,0 +1,143 @@
+#
+# -*- encoding: UTF8 -*-
+
+
+#   This file is part of netio230a.
+#
+#   netio230a is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   netio230a is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with netio230a.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Simulates many fake NETIO-230A devices in a single asyncio event loop (no thread per
+device or connection) to load-test tools working with lots of devices:
+
+    async with FakeNetio230aSimulator(1000) as simulator:
+        fleet = Fleet([("fake", host, port, "admin", "admin") for host, port in simulator.addresses])
+        await fleet.run("getPowerSocketList")
+"""
+
+import asyncio
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+from .fakeserver import FakeKshellSession, FakeNetio230a, READ_CHUNK_SIZE
+
+
+def raiseOpenFilesLimit():
+    """ every simulated device needs a listening socket and one more per connection:
+    raise the soft limit of open file descriptors as far as we are allowed to """
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard == resource.RLIM_INFINITY or soft < hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError):
+            pass
+
+
+class FakeNetio230aSimulator(object):
+    """Each device of the simulator listens on its own TCP port and has its own state.
+    devices is the number of devices to simulate or a list of FakeNetio230a objects (or their configuration dicts),
+    ports an optional list of TCP ports for them (by default free ports are chosen).
+    Once started, addresses holds the (host, port) of the devices (in the same order)."""
+
+    def __init__(self, devices=1, host="127.0.0.1", ports=None, logfile_name="", capture=None):
+        if isinstance(devices, int):
+            devices = [None] * devices
+        self.devices = [FakeNetio230a.fromConfig(device) for device in devices]
+        self.host = host
+        self.ports = [0] * len(self.devices) if ports is None else list(ports)
+        self.addresses = []
+        # a capture.CaptureWriter recording the sessions of all devices:
+        self.capture = capture
+        self.__servers = []
+        self.logging = False
+        if logfile_name != "":
+            self.logfile = open(logfile_name,'a')
+            self.logging = True
+
+    def log(self, message):
+        if self.logging: self.logfile.write(message)
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop()
+
+    async def start(self):
+        """ starts listening for connections to all devices """
+        raiseOpenFilesLimit()
+        for device, port in zip(self.devices, self.ports):
+            server = await asyncio.start_server(self.__connectionHandler(device), self.host, port)
+            self.__servers.append(server)
+            self.addresses.append(server.sockets[0].getsockname()[0:2])
+
+    async def stop(self):
+        servers = self.__servers
+        self.__servers = []
+        self.addresses = []
+        for server in servers:
+            server.close()
+        await asyncio.gather(*[server.wait_closed() for server in servers], return_exceptions=True)
+
+    async def serve_forever(self):
+        if len(self.__servers) == 0:
+            await self.start()
+        await asyncio.gather(*[server.serve_forever() for server in self.__servers])
+
+    def __connectionHandler(self, device):
+        async def handle(reader, writer):
+            await self.__serve(device, reader, writer)
+        return handle
+
+    async def __serve(self, device, reader, writer):
+        session = FakeKshellSession()
+        if not session.startSession(device, self.log, self.capture):
+            # like the hardware we drop the connection of a second client:
+            writer.transport.abort()
+            return
+        try:
+            await self.__write(writer, session.welcome(), session)
+            while True:
+                try:
+                    data = await asyncio.wait_for(reader.read(READ_CHUNK_SIZE), session.profile.idle_timeout)
+                except asyncio.TimeoutError:
+                    await self.__write(writer, session.idleTimeout(), session)
+                    break
+                if len(data) == 0:
+                    break
+                writes, close = session.receiveData(data)
+                await self.__write(writer, writes, session)
+                if close:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            session.endSession()
+            writer.close()
+
+    async def __write(self, writer, writes, session):
+        for pause, data in writes:
+            if pause > 0:
+                await asyncio.sleep(pause)
+            self.log(data.decode('ascii'))
+            writer.write(data)
+            await writer.drain()
+            session.sent(data)
@@ -0,0 +1,77 @@
+#
+# -*- encoding: UTF8 -*-
+
+
+#   This file is part of netio230a.
+#
+#   netio230a is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   netio230a is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with netio230a.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Immutable representations of the state of the power sockets of a NETIO-230A.
+"""
+
+import time
+from collections import namedtuple
+
+
+class OutletState(namedtuple('OutletState', ['number', 'name', 'power_on', 'manual_mode', 'interrupt_delay', 'power_on_after_power_loss'])):
+    """ The state of one power socket (number is one based). Being a tuple it is hashable,
+    cheap to compare and needs no per-instance dictionary. The getters of the PowerSocket class
+    are provided so that code written for it keeps working. """
+    __slots__ = ()
+
+    def getName(self):
+        return self.name
+    def getPowerOn(self):
+        return self.power_on
+    def getManualMode(self):
+        return self.manual_mode
+    def getTimerMode(self):
+        return not self.manual_mode
+    def getInterruptDelay(self):
+        return self.interrupt_delay
+    def getPowerOnAfterPowerLoss(self):
+        return self.power_on_after_power_loss
+    def getWatchdogOn(self):
+        # the watchdog settings are not part of 'port setup'
+        return False
+
+    def toDict(self):
+        return dict(zip(self._fields, self))
+
+
+class DeviceSnapshot(namedtuple('DeviceSnapshot', ['host', 'timestamp', 'outlets'])):
+    """ The state of all power sockets of a device at one point in time.
+    timestamp is taken from time.monotonic(), outlets is a tuple of OutletState. """
+    __slots__ = ()
+
+    @classmethod
+    def create(cls, host, outlets, timestamp=None):
+        return cls(host, time.monotonic() if timestamp is None else timestamp, tuple(outlets))
+
+    def sameState(self, other):
+        """ True if the outlets are in the same state (no matter when the snapshots were taken) """
+        return self.outlets == other.outlets
+
+    def diff(self, other):
+        """ returns a list of (old, new) OutletState pairs for the outlets that differ in the other (newer) snapshot """
+        return [(old, new) for old, new in zip(self.outlets, other.outlets) if old != new]
+
+    def toDict(self):
+        return {'host': self.host, 'timestamp': self.timestamp, 'outlets': [outlet.toDict() for outlet in self.outlets]}
+
+    @classmethod
+    def fromDict(cls, data):
+        return cls(data['host'], data['timestamp'], tuple([OutletState(**outlet) for outlet in data['outlets']]))
@@ -0,0 +1,200 @@
+#
+# -*- encoding: UTF8 -*-
+
+
+#   This file is part of netio230a.
+#
+#   netio230a is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   netio230a is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License
+#   along with netio230a.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Switch many outlets on many devices as fast as the power supply allows.
+
+Switching on a load draws an inrush current, so switching on a whole rack at once may
+trip a breaker. The SwitchScheduler spaces the switching:
+
+ - the outlets of a device are switched at least swdelay apart (as the device does it itself),
+ - at most rate outlets per second are switched on (over all devices),
+ - the loads switched on within window seconds must not exceed power_budget.
+
+Within these limits all devices are switched in parallel and every outlet as early as possible:
+
+    async with Fleet.fromConfiguration() as fleet:
+        scheduler = SwitchScheduler(fleet, rate=10, power_budget=3000, loads={("rack-7", 1): 800})
+        for result in await scheduler.run([("rack-7", 1, True), ("rack-7", 2, True), ("rack-8", 1, True)]):
+            print(result.device.name, result.outlet, result.started, result.error)
+"""
+
+import asyncio
+import time
+from collections import namedtuple, deque
+
+# the time window of the power budget [in seconds]:
+INRUSH_WINDOW = 1.0
+# the load of an outlet not listed in loads (with the default the power budget counts outlets):
+DEFAULT_LOAD = 1.0
+
+# at is the time (in seconds after the start) the switching is planned for
+ScheduledSwitch = namedtuple('ScheduledSwitch', ['device', 'outlet', 'state', 'at'])
+# planned, started and finished are given in seconds after the start, error is the exception raised (or None)
+SwitchResult = namedtuple('SwitchResult', ['device', 'outlet', 'state', 'planned', 'started', 'finished', 'error'])
+
+
+class PowerBudget(object):
+    """ the loads switched on within the last window seconds (switched on in chronological order) """
+
+    def __init__(self, budget, window=INRUSH_WINDOW):
+        self.budget = budget
+        self.window = window
+        self.__recent = deque()
+        self.__sum = 0.
+
+    def earliest(self, at, load):
+        """ returns the earliest time (not before at) the load can be switched on """
+        if self.budget is None:
+            return at
+        if load > self.budget:
+            raise NameError("A load of %g exceeds the power budget of %g." % (load, self.budget))
+        total = self.__sum
+        for switched, switched_load in self.__recent:
+            if switched > at - self.window and total + load <= self.budget:
+                break
+            if switched > at - self.window:
+                # wait until this one is out of the window:
+                at = switched + self.window
+            total -= switched_load
+        return at
+
+    def add(self, at, load):
+        if self.budget is None:
+            return
+        while self.__recent and self.__recent[0][0] <= at - self.window:
+            self.__sum -= self.__recent.popleft()[1]
+        self.__recent.append((at, load))
+        self.__sum += load
+
+
+def planSwitching(targets, swdelays, rate=None, power_budget=None, loads=None, window=INRUSH_WINDOW):
+    """ returns the ScheduledSwitch list (ordered by time) for the targets, a list of (device, outlet, state).
+    swdelays is a dict {device: switch delay in seconds}, loads a dict {(device, outlet): load}.
+    The targets of a device are switched in the given order. Every switching starts as early as the
+    constraints allow; if several devices could go next, the one with the most targets left goes first. """
+    loads = loads or {}
+    queues = {}
+    for device, outlet, state in targets:
+        queues.setdefault(device, deque()).append((outlet, bool(state)))
+    # when the next switching of each device may start:
+    device_ready = dict([(device, 0.) for device in queues])
+    next_on = 0.
+    budget = PowerBudget(power_budget, window)
+    plan = []
+    while queues:
+        best = None
+        for device, queue in queues.items():
+            outlet, state = queue[0]
+            at = device_ready[device]
+            if state:
+                at = max(at, next_on)
+                at = budget.earliest(at, loads.get((device, outlet), DEFAULT_LOAD))
+            if best is None or (at, -len(queue)) < (best[0], -len(queues[best[1]])):
+                best = (at, device)
+        at, device = best
+        outlet, state = queues[device].popleft()
+        if not queues[device]:
+            del queues[device]
+        plan.append(ScheduledSwitch(device, outlet, state, at))
+        device_ready[device] = at + swdelays.get(device, 0.)
+        if state:
+            if rate:
+                next_on = at + 1.0/rate
+            budget.add(at, loads.get((device, outlet), DEFAULT_LOAD))
+    return plan
+
+
+class SwitchScheduler(object):
+    """ Switches outlets of the devices of a Fleet according to planSwitching().
+    The devices of the targets may be given as FleetDevice or by their name,
+    the keys of loads (device, outlet) the same way. """
+
+    def __init__(self, fleet, rate=None, power_budget=None, loads=None, window=INRUSH_WINDOW):
+        self.fleet = fleet
+        self.rate = rate
+        self.power_budget = power_budget
+        self.window = window
+        self.loads = dict([((self.device(device), outlet), load) for (device, outlet), load in (loads or {}).items()])
+        # the switch delays read by the last plan() {FleetDevice: seconds}:
+        self.swdelays = {}
+
+    def device(self, device):
+        """ returns the FleetDevice (given by itself or its name) """
+        if not isinstance(device, str):
+            return device
+        for fleet_device in self.fleet.devices:
+            if fleet_device.name == device:
+                return fleet_device
+        raise NameError("Unknown device: %s" % device)
+
+    async def plan(self, targets):
+        """ reads the switch delays of the devices (logging in to them) and returns the plan (see planSwitching()) """
+        targets = [(self.device(device), int(outlet), state) for device, outlet, state in targets]
+        devices = list(dict.fromkeys([device for device, outlet, state in targets]))
+        self.swdelays = {}
+        for result in await self.fleet.run("getSwitchDelay", devices=devices):
+            if result.error is not None:
+                raise NameError("Couldn't read the switch delay of %s: %s" % (result.device.name, result.error))
+            self.swdelays[result.device] = result.value
+        return planSwitching(targets, self.swdelays, self.rate, self.power_budget, self.loads, self.window)
+
+    async def run(self, targets):
+        """ switches the targets, a list of (device, outlet, state), and returns a list of SwitchResult (ordered by the plan).
+        A device stops at its first error (its remaining outlets are reported with the same error). """
+        plan = await self.plan(targets)
+        # the numbers of the scheduled switches (in the plan) of each device:
+        by_device = {}
+        for number, switch in enumerate(plan):
+            by_device.setdefault(switch.device, []).append(number)
+        results = [None] * len(plan)
+        # like Fleet.run() at most fleet.concurrency devices are busy at a time, but a device only
+        # takes a slot to switch (not while it waits, so that no device falls behind its plan):
+        semaphore = asyncio.Semaphore(self.fleet.concurrency)
+        start = time.monotonic()
+        async def switch(client, number):
+            async with semaphore:
+                started = time.monotonic() - start
+                await client.setPowerSocketPower(plan[number].outlet, plan[number].state)
+                return started
+        async def switch_device(device):
+            client = self.fleet.client(device)
+            error = None
+            previous = None
+            for number in by_device[device]:
+                scheduled = plan[number]
+                started = None
+                if error is None:
+                    at = scheduled.at
+                    if previous is not None:
+                        # a late switching must not shorten the switch delay to the next one:
+                        at = max(at, previous + self.swdelays.get(device, 0.))
+                    await asyncio.sleep(max(0., start + at - time.monotonic()))
+                    try:
+                        # the timeout counts from the actual start (a switching delayed by the
+                        # switch delay gets as much time as any other):
+                        started = await asyncio.wait_for(switch(client, number), self.fleet.timeout)
+                        previous = started
+                    except Exception as exception:
+                        error = exception
+                finished = None if started is None else time.monotonic() - start
+                results[number] = SwitchResult(device, scheduled.outlet, scheduled.state, scheduled.at, started, finished, error)
+        await asyncio.gather(*[switch_device(device) for device in by_device])
+        return results
@@ -17,6 +17,8 @@ setup(name='netio230a',
       url = 'https://github.com/pklaus/netio230a',
       license = 'GPL3+',
       packages = ['netio230a'],
+      # asyncio (async def, get_running_loop), time.monotonic and concurrent.futures:
+      python_requires = '>=3.7',
       scripts = ['scripts/netio230a_cli', 'scripts/netio230a_discovery', 'scripts/netio230a_fakeserver'],
       zip_safe = True,
       platforms = 'any',
@@ -26,8 +28,8 @@ setup(name='netio230a',
           'Operating System :: OS Independent',
           'License :: OSI Approved :: GPL License',
           'Programming Language :: Python',
-          'Programming Language :: Python :: 2',
           'Programming Language :: Python :: 3',
+          'Programming Language :: Python :: 3 :: Only',
       ]
 )
 